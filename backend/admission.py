@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+from metrics import registry
+
+
+# Limit on the requests of one kind running at once in this worker.
+# Requests over the limit wait in line for up to queue_timeout seconds. A request is rejected
+# once the wait times out, or at once when max_queue requests are already waiting, so an
+# overload fails fast instead of adding to the latency of every request.
+class AdmissionLimit:
+    def __init__(self, limit, queue_timeout=1.0, max_queue=50):
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.slots = None
+
+    # Wait for a slot, returning whether the request was admitted
+    async def acquire(self):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.limit)
+        if self.slots.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.running -= 1
+        self.slots.release()
+
+    def snapshot(self):
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "waiting": self.waiting,
+            "queue_timeout_seconds": self.queue_timeout,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+# ASGI middleware admitting the requests of the limited routes, keyed by (method, path), through
+# their AdmissionLimit. A request holds its slot until the end of its response is sent, so a
+# streamed export counts for as long as it streams. Rejected requests get 503 with Retry-After.
+class AdmissionMiddleware:
+    def __init__(self, app, limits, retry_after=1, registry=registry):
+        self.app = app
+        self.limits = limits
+        self.retry_after = retry_after
+        self.rejections = registry.counter(
+            "http_requests_rejected_total", "Requests rejected by admission control, by route.", ("route",)
+        )
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get((scope["method"], scope["path"])) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await limit.acquire():
+            self.rejections.inc(scope["path"])
+            await self.reject(send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release()
+
+    async def reject(self, send):
+        body = json.dumps({"detail": "Server is busy, retry later"}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(self.retry_after).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
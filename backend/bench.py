@@ -0,0 +1,266 @@
+# Load benchmark of the API routes, run against the real app.
+# By default the app runs in process behind httpx's ASGI transport, on the storage picked
+# with --backend, so it needs no server or network. With --url the same requests go over a
+# socket to a running server instead (e.g. uvicorn main:app). Every size in --shows is
+# seeded through /import/, then each route is timed and reported with its throughput and
+# p50/p95/p99 latency. Every request goes to the list named by --list-id, which the import
+# replaces and which is emptied once the benchmark is done, so the other lists of a running
+# server are left alone. --output saves the results as JSON, --compare diffs them against
+# the results of an earlier run.
+# Run with: python bench.py --backend sqlite --shows 1000 100000 --output bench.json
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from bson import ObjectId
+
+import main
+from storage import DEFAULT_LIST
+
+# List the benchmark seeds and times. Its shows are replaced by the benchmark.
+BENCH_LIST = "bench"
+
+STATUSES = ["watching", "completed", "plan to watch", "dropped"]
+
+
+def make_shows(count):
+    return [
+        {"id": str(ObjectId()), "title": f"Show {i:07d}", "status": STATUSES[i % len(STATUSES)], "current_episode": i % 100}
+        for i in range(count)
+    ]
+
+
+# Latency at the given percentile, by the nearest rank
+def percentile(latencies, percent):
+    if not latencies:
+        return None
+    rank = max(int(round(percent / 100 * len(latencies))), 1)
+    return latencies[rank - 1]
+
+
+def summarize(latencies, errors, elapsed, rows=None):
+    latencies = sorted(latencies)
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+    }
+    for percent in (50, 95, 99):
+        value = percentile(latencies, percent)
+        result[f"p{percent}_ms"] = round(value * 1000, 3) if value is not None else None
+    if rows is not None:
+        result["rows_per_second"] = round(rows / elapsed, 1) if elapsed else None
+    return result
+
+
+# Send count requests, at most concurrency at a time. make_request(i) returns the request's coroutine.
+async def measure(make_request, count, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await make_request(i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def seed(client, shows):
+    content = json.dumps(shows).encode("utf-8")
+    start = time.perf_counter()
+    response = await client.post("/import/", files={"file": ("shows.json", content, "application/json")})
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    return summarize([elapsed], 0, elapsed, rows=len(shows))
+
+
+async def run_routes(client, shows, requests, concurrency, export_rounds):
+    rng = random.Random(0)
+    ids = [show["id"] for show in shows]
+    by_id = {show["id"]: show for show in shows}
+    sample = [rng.choice(ids) for _ in range(requests)]
+    depth = len(ids) // 2
+    # Cursor of the page halfway through the default (id) order, as a client walking there would hold it
+    depth_cursor = main.encode_cursor({"id": sorted(ids)[depth - 1], "sort": None, "order": "asc"}) if depth else None
+    run = ObjectId()
+    results = {}
+
+    created = []
+
+    async def create(i):
+        response = await client.post("/shows/", json={"title": f"Bench {run} {i}", "status": "watching", "current_episode": 1})
+        if response.status_code == 201:
+            created.append(response.json()["id"])
+        return response
+
+    results["POST /shows/"] = await measure(create, requests, concurrency)
+    results["GET /shows/{id}"] = await measure(lambda i: client.get(f"/shows/{sample[i]}"), requests, concurrency)
+    results["PUT /shows/{id}"] = await measure(
+        lambda i: client.put(f"/shows/{sample[i]}", json={**{key: by_id[sample[i]][key] for key in ("title", "status")}, "current_episode": i}),
+        requests,
+        concurrency,
+    )
+    results["DELETE /shows/{id}"] = await measure(lambda i: client.delete(f"/shows/{created[i]}"), len(created), concurrency)
+
+    results["GET /shows/ first page"] = await measure(lambda i: client.get("/shows/", params={"limit": 50}), requests, concurrency)
+    if depth:
+        results["GET /shows/ skip to depth"] = await measure(
+            lambda i: client.get("/shows/", params={"limit": 50, "skip": depth}), requests, concurrency
+        )
+        results["GET /shows/ cursor at depth"] = await measure(
+            lambda i: client.get("/shows/", params={"limit": 50, "cursor": depth_cursor}), requests, concurrency
+        )
+    results["GET /shows/ filtered and sorted"] = await measure(
+        lambda i: client.get("/shows/", params={"limit": 50, "status": STATUSES[i % len(STATUSES)], "sort": "current_episode", "order": "desc"}),
+        requests,
+        concurrency,
+    )
+    results["GET /shows/search"] = await measure(
+        lambda i: client.get("/shows/search", params={"q": by_id[sample[i]]["title"][:10]}), requests, concurrency
+    )
+    results["GET /shows/suggest"] = await measure(
+        lambda i: client.get("/shows/suggest", params={"q": by_id[sample[i]]["title"][:8]}), requests, concurrency
+    )
+    results["POST /shows/batch/get"] = await measure(
+        lambda i: client.post("/shows/batch/get", json={"ids": sample[i:i + 50]}), requests, concurrency
+    )
+
+    for export_format in ("json", "ndjson", "csv"):
+        summary = await measure(lambda i: client.get("/export/", params={"format": export_format}), export_rounds, 1)
+        summary["rows_per_second"] = round(len(ids) * summary["throughput"], 1)
+        results[f"GET /export/?format={export_format}"] = summary
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Run the whole benchmark and return the results as a JSON compatible dict
+async def run_benchmark(backend="memory", sizes=(1000,), requests=200, concurrency=10, export_rounds=3, url=None, cache=False, sqlite_path=None, list_id=BENCH_LIST):
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "backend": "remote" if url else backend,
+        "url": url,
+        "list_id": list_id,
+        "requests": requests,
+        "concurrency": concurrency,
+        "read_cache": cache,
+        "sizes": {},
+    }
+    cache_enabled = main.read_cache.enabled
+    repository = None
+    if url:
+        client = httpx.AsyncClient(base_url=url, headers={"X-List-Id": list_id}, timeout=None)
+    else:
+        main.STORAGE_BACKEND = backend
+        main.SQLITE_PATH = sqlite_path or main.SQLITE_PATH
+        repository = main.create_repository()
+        await repository.start()
+        await main.shows_version.load(repository)
+        main.app.state.repository = repository
+        main.read_cache.enabled = cache
+        main.read_cache.clear()
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=main.app), base_url="http://bench", headers={"X-List-Id": list_id}, timeout=None
+        )
+
+    try:
+        async with client:
+            try:
+                for size in sizes:
+                    shows = make_shows(size)
+                    results = {"POST /import/": await seed(client, shows)}
+                    results.update(await run_routes(client, shows, requests, concurrency, export_rounds))
+                    report["sizes"][str(size)] = results
+            finally:
+                # Leave the benchmark's list empty
+                await client.post("/create-shows-list/")
+    finally:
+        main.read_cache.enabled = cache_enabled
+        if repository:
+            await repository.close()
+    return report
+
+
+def print_report(report, baseline=None):
+    print(f"backend {report['backend']}, {report['requests']} requests per route, concurrency {report['concurrency']}")
+    for size, results in report["sizes"].items():
+        print(f"\n{size} shows")
+        print(f"{'route':36} {'req/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for route, result in results.items():
+            line = f"{route:36} {result['throughput'] or 0:10.1f} {result['p50_ms'] or 0:9.2f} {result['p95_ms'] or 0:9.2f} {result['p99_ms'] or 0:9.2f} {result['errors']:7d}"
+            before = ((baseline or {}).get("sizes", {}).get(size) or {}).get(route)
+            if before and before.get("p50_ms") and result.get("p50_ms"):
+                line += f"  p50 {result['p50_ms'] / before['p50_ms']:.2f}x of baseline"
+            print(line)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark every route of the shows API.")
+    parser.add_argument("--backend", choices=["memory", "sqlite", "mongo"], default=os.getenv("STORAGE_BACKEND", "memory"))
+    parser.add_argument("--sqlite-path", help="database file of the sqlite backend, a temporary file by default")
+    parser.add_argument("--url", help="benchmark a running server at this URL instead of the app in process")
+    parser.add_argument("--list-id", default=BENCH_LIST, help=f"list to seed and time, replaced by the benchmark and emptied after it (default {BENCH_LIST})")
+    parser.add_argument("--shows", type=int, nargs="+", default=[1000], help="collection sizes to seed, e.g. 1000 100000 1000000")
+    parser.add_argument("--requests", type=int, default=200, help="requests sent per route")
+    parser.add_argument("--concurrency", type=int, default=10, help="requests in flight at once")
+    parser.add_argument("--export-rounds", type=int, default=3, help="full exports timed per format")
+    parser.add_argument("--cache", action="store_true", help="keep the read cache on, which is off by default")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+    if args.url and args.list_id == DEFAULT_LIST:
+        parser.error("--list-id must name a list of its own with --url, the benchmark replaces the shows of that list")
+
+    sqlite_path = args.sqlite_path
+    temporary = None
+    if args.backend == "sqlite" and not sqlite_path and not args.url:
+        temporary = tempfile.mkdtemp()
+        sqlite_path = os.path.join(temporary, "bench.db")
+
+    try:
+        report = asyncio.run(run_benchmark(
+            args.backend, args.shows, args.requests, args.concurrency, args.export_rounds, args.url, args.cache, sqlite_path, args.list_id
+        ))
+    finally:
+        if temporary:
+            for name in os.listdir(temporary):
+                os.remove(os.path.join(temporary, name))
+            os.rmdir(temporary)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
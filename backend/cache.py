@@ -0,0 +1,153 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+# Bounded in-process LRU cache whose entries also expire after a fixed time.
+# Keys are tuples whose first items are a namespace, e.g. ("show", list_id, show_id),
+# so all entries of one kind, or of one kind and list, can be dropped together.
+# A read that started before an invalidation must not cache what it read, since that may
+# be older than the write that invalidated it. Readers take the generation of their key
+# before reading and pass it to set, which skips the entry if the key was invalidated since.
+class ReadCache:
+    def __init__(self, max_entries=1024, ttl_seconds=10.0, enabled=True, max_namespaces=4096):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.max_namespaces = max_namespaces
+        self._entries = OrderedDict()
+        # Count of invalidations so far, and the count at the latest invalidation of each
+        # namespace, keyed by its first two items at most and least recently invalidated first.
+        # Namespaces beyond max_namespaces are forgotten, and the latest of their counts is
+        # kept as the floor of every namespace not listed.
+        self._invalidated = 0
+        self._generations = OrderedDict()
+        self._floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    # Token taken before a read, for set to tell whether the key, its namespace or the whole
+    # cache was invalidated since
+    def generation(self, key):
+        return self._invalidated
+
+    def _invalidated_at(self, key):
+        return max(self._generations.get(key[:length], self._floor) for length in range(3))
+
+    def _bump(self, namespace):
+        namespace = namespace[:2]
+        self._invalidated += 1
+        self._generations[namespace] = self._invalidated
+        self._generations.move_to_end(namespace)
+        while len(self._generations) > self.max_namespaces:
+            self._floor = self._generations.popitem(last=False)[1]
+
+    def set(self, key, value, generation=None):
+        if not self.enabled:
+            return
+        if generation is not None and self._invalidated_at(key) > generation:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._bump(key)
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def invalidate_namespace(self, *namespace):
+        self._bump(namespace)
+        keys = [key for key in self._entries if key[:len(namespace)] == namespace]
+        for key in keys:
+            del self._entries[key]
+        self.invalidations += len(keys)
+
+    def clear(self):
+        self._bump(())
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def snapshot(self):
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "namespaces": len(self._generations),
+        }
+
+
+# Merges identical reads in flight. The first caller of a key starts the read as a task, and
+# callers of the same key arriving before it ends await that task instead of reading again.
+# A caller going away does not cancel the read for the others. Keys are namespaced like
+# those of ReadCache, and a write forgets the keys it may have changed, so reads starting
+# after it do not join a read that started before it.
+class SingleFlight:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._flights = {}
+        self.reads = 0
+        self.coalesced = 0
+
+    async def run(self, key, read):
+        if not self.enabled:
+            return await read()
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(read())
+            self._flights[key] = task
+            task.add_done_callback(lambda done: self._land(key, done))
+            self.reads += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _land(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # Retrieve the error, so a read whose callers all went away is not logged as unhandled.
+        if not task.cancelled():
+            task.exception()
+
+    def forget(self, key):
+        self._flights.pop(key, None)
+
+    def forget_namespace(self, *namespace):
+        for key in [key for key in self._flights if key[:len(namespace)] == namespace]:
+            del self._flights[key]
+
+    def snapshot(self):
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "reads": self.reads,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+
+from bson import ObjectId
+
+
+# Show as sent in change events
+def show_event_data(show):
+    show_id = show["id"] if "id" in show else str(show["_id"])
+    return {"id": show_id, "title": show.get("title"), "status": show.get("status"), "current_episode": show.get("current_episode")}
+
+
+class ChangeEvent:
+    def __init__(self, event_id, event_type, data):
+        self.id = event_id
+        self.type = event_type
+        self.data = data
+
+    def format(self):
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data, separators=(',', ':'))}\n\n"
+
+
+class Subscription:
+    def __init__(self, queue_size):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflows = 0
+
+    async def get(self):
+        return await self.queue.get()
+
+
+# In-process publish/subscribe of show changes for the SSE feed.
+# Every event gets an id of the form "<epoch>-<sequence>", and the latest events are kept
+# so a client reconnecting with Last-Event-ID gets what it missed. Each subscriber has a
+# bounded queue; a subscriber that falls behind is sent a single "reset" event telling it
+# to refetch, instead of the broker holding an unbounded backlog for it.
+class ChangeBroker:
+    def __init__(self, buffer_size=1000, queue_size=100):
+        self.epoch = str(ObjectId())
+        self.queue_size = queue_size
+        self.sequence = 0
+        self.recent = deque(maxlen=buffer_size)
+        self.subscribers = set()
+        # Set while a database change stream feeds the broker, so the write endpoints don't publish twice.
+        self.external_feed = False
+
+    def publish(self, event_type, data):
+        self.sequence += 1
+        event = ChangeEvent(f"{self.epoch}-{self.sequence}", event_type, data)
+        self.recent.append(event)
+        for subscription in self.subscribers:
+            self._deliver(subscription, event)
+        return event
+
+    # Called by the write endpoints, ignored while a change stream is the source of events
+    def publish_write(self, event_type, data):
+        if not self.external_feed:
+            self.publish(event_type, data)
+
+    def subscribe(self, last_event_id=None):
+        subscription = Subscription(self.queue_size)
+        self.subscribers.add(subscription)
+        if last_event_id:
+            missed = self._events_after(last_event_id)
+            if missed is None:
+                self._deliver(subscription, self._reset_event())
+            else:
+                for event in missed:
+                    self._deliver(subscription, event)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+
+    def _events_after(self, last_event_id):
+        epoch, _, sequence = last_event_id.rpartition("-")
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if sequence > self.sequence:
+            return None
+        first_kept = self.sequence - len(self.recent) + 1
+        if sequence + 1 < first_kept:
+            return None
+        return list(self.recent)[sequence + 1 - first_kept:]
+
+    def _reset_event(self):
+        return ChangeEvent(f"{self.epoch}-{self.sequence}", "reset", {})
+
+    def _deliver(self, subscription, event):
+        try:
+            subscription.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Drop the backlog and tell the client to refetch, resuming after the latest event.
+            subscription.overflows += 1
+            while not subscription.queue.empty():
+                subscription.queue.get_nowait()
+            subscription.queue.put_nowait(self._reset_event())
+
+    def snapshot(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "last_event_id": f"{self.epoch}-{self.sequence}",
+            "source": "change_stream" if self.external_feed else "in_process",
+        }
+
+
+# Change brokers of the show lists, each created when a client first watches its list.
+# Writes to a list nobody watches publish nothing. Once its last subscriber has gone a
+# broker is kept idle_seconds, so a client reconnecting soon after still resumes from its
+# Last-Event-ID, and only max_idle brokers are kept idle at once; a client reconnecting
+# to a forgotten broker is sent reset. Setting external_feed sets it on every broker,
+# including those created later.
+class ChangeBrokers:
+    def __init__(self, buffer_size=1000, queue_size=100, idle_seconds=60.0, max_idle=1024):
+        self.buffer_size = buffer_size
+        self.queue_size = queue_size
+        self.idle_seconds = idle_seconds
+        self.max_idle = max_idle
+        self.lists = {}
+        # Time each broker without subscribers became idle, oldest first
+        self.idle = OrderedDict()
+        self._external_feed = False
+
+    @property
+    def external_feed(self):
+        return self._external_feed
+
+    @external_feed.setter
+    def external_feed(self, value):
+        self._external_feed = value
+        for broker in self.lists.values():
+            broker.external_feed = value
+
+    # Broker of a list, for a client about to subscribe to it
+    def get(self, list_id):
+        self._forget_idle()
+        self.idle.pop(list_id, None)
+        broker = self.lists.get(list_id)
+        if broker is None:
+            broker = self.lists[list_id] = ChangeBroker(self.buffer_size, self.queue_size)
+            broker.external_feed = self._external_feed
+        return broker
+
+    # Called once a client is done with the broker of a list. A broker left without
+    # subscribers is forgotten at once if nothing was published to it, or else turns idle.
+    def release(self, list_id):
+        broker = self.lists.get(list_id)
+        if broker is not None and not broker.subscribers:
+            if not broker.sequence:
+                del self.lists[list_id]
+            elif list_id not in self.idle:
+                self.idle[list_id] = time.monotonic()
+        self._forget_idle()
+
+    def _forget_idle(self):
+        expired = time.monotonic() - self.idle_seconds
+        while self.idle:
+            list_id, since = next(iter(self.idle.items()))
+            if since > expired and len(self.idle) <= self.max_idle:
+                break
+            del self.idle[list_id]
+            del self.lists[list_id]
+
+    # Publish an event to the broker of a list, if anybody watches it
+    def publish(self, list_id, event_type, data):
+        broker = self.lists.get(list_id)
+        if broker is not None:
+            broker.publish(event_type, data)
+
+    # Called by the write endpoints, like ChangeBroker.publish_write
+    def publish_write(self, list_id, event_type, data):
+        if not self._external_feed:
+            self.publish(list_id, event_type, data)
+
+    # Publish an event to every list, such as a reset when the whole database went away
+    def publish_all(self, event_type, data):
+        for broker in self.lists.values():
+            broker.publish(event_type, data)
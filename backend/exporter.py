@@ -0,0 +1,98 @@
+import csv
+import io
+import json
+import zlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Serialized output is collected into chunks of about this size before being sent.
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+EXPORT_FORMATS = {
+    "json": ("application/json", "shows.json"),
+    "ndjson": ("application/x-ndjson", "shows.ndjson"),
+    "csv": ("text/csv", "shows.csv"),
+}
+
+CSV_FIELDS = ["id", "title", "status", "current_episode"]
+
+# Columns of an incremental export, where a row is either a changed show or a tombstone.
+CHANGE_CSV_FIELDS = CSV_FIELDS + ["rev", "updated_at", "deleted", "deleted_at"]
+
+
+# Same bytes as json.dump(shows, f, indent=4), written one show at a time.
+async def iter_json(shows, fast=False):
+    first = True
+    async for show in shows:
+        item = json.dumps(show, indent=4).replace("\n", "\n    ")
+        yield ("[\n    " if first else ",\n    ") + item
+        first = False
+    yield "[]" if first else "\n]"
+
+
+async def iter_ndjson(shows, fast=False):
+    async for show in shows:
+        if fast and orjson is not None:
+            yield orjson.dumps(show, option=orjson.OPT_APPEND_NEWLINE).decode("utf-8")
+        else:
+            yield json.dumps(show, separators=(",", ":")) + "\n"
+
+
+async def iter_csv(shows, fast=False, fields=CSV_FIELDS):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    async for show in shows:
+        writer.writerow(show)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+SERIALIZERS = {"json": iter_json, "ndjson": iter_ndjson, "csv": iter_csv}
+
+
+# Whether an Accept-Encoding header allows a gzip response.
+def accepts_gzip(accept_encoding):
+    qualities = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+# Serialize shows in the given format as a stream of byte chunks, optionally gzipped.
+# fast encodes ndjson with orjson when it is installed. csv_fields are the columns of a csv export.
+async def iter_export(shows, export_format, gzip=False, chunk_size=EXPORT_CHUNK_SIZE, fast=False, csv_fields=CSV_FIELDS):
+    compressor = zlib.compressobj(wbits=31) if gzip else None
+    pending = []
+    pending_size = 0
+    texts = iter_csv(shows, fast, csv_fields) if export_format == "csv" else SERIALIZERS[export_format](shows, fast)
+    async for text in texts:
+        pending.append(text)
+        pending_size += len(text)
+        if pending_size >= chunk_size:
+            data = "".join(pending).encode("utf-8")
+            pending = []
+            pending_size = 0
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+
+    data = "".join(pending).encode("utf-8")
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
@@ -0,0 +1,152 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import NamedTemporaryFile
+
+from bson import ObjectId
+
+from importer import IMPORT_CHUNK_SIZE, ImportReport, read_json_items, validate_import_rows
+
+
+# Parse the next chunk of a spooled import and check it against the schema. Runs in a
+# worker process, so it only takes and returns plain values.
+def parse_import_chunk(path, offset, batch_size, first_row):
+    rows, offset, done = read_json_items(path, offset, batch_size)
+    valid, errors = validate_import_rows(rows, first_row)
+    return valid, errors, len(rows), offset, done
+
+
+# One background import of a spooled upload, reporting its outcome as it goes.
+# state is "queued", "running", "completed", "failed" or "cancelled". The app's run(job)
+# checks cancel_requested between chunks, so the chunks written before stay written.
+class ImportJob(ImportReport):
+    def __init__(self, path, size, batch_size, max_errors, list_id=None):
+        super().__init__(max_errors)
+        self.id = str(ObjectId())
+        self.list_id = list_id
+        self.path = path
+        self.size = size
+        self.batch_size = batch_size
+        self.state = "queued"
+        self.detail = None
+        self.offset = 0
+        self.rows = 0
+        self.cancel_requested = False
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+
+    @property
+    def finished(self):
+        return self.state in ("completed", "failed", "cancelled")
+
+    # The job's state, with its errors from errors_offset on, up to errors_limit of them
+    def snapshot(self, errors_offset=0, errors_limit=None):
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            "id": self.id,
+            "list_id": self.list_id,
+            "state": self.state,
+            "detail": self.detail,
+            "bytes_read": self.offset,
+            "bytes_total": self.size,
+            "progress": round(self.offset / self.size, 4) if self.size else 1.0,
+            "rows": self.rows,
+            **self.counts,
+            "rows_per_second": round(self.rows / elapsed, 1) if elapsed > 0 else 0.0,
+            "elapsed_seconds": round(elapsed, 3),
+            "errors": self.errors[errors_offset:None if errors_limit is None else errors_offset + errors_limit],
+            "errors_omitted": self.errors_omitted,
+        }
+
+
+# Background import jobs of this worker.
+# Uploads are spooled to a file and imported one job at a time by run(job), a coroutine
+# supplied by the app. Chunks are parsed and validated in a process pool, or on a thread
+# when processes is 0, so the event loop only does the writes. The latest finished jobs
+# are kept for GET /import/jobs/{id}.
+class ImportJobs:
+    def __init__(self, spool_dir=None, processes=1, concurrency=1, max_errors=0, keep_finished=100):
+        self.spool_dir = spool_dir
+        self.processes = processes
+        self.max_errors = max_errors
+        self.keep_finished = keep_finished
+        self.concurrency = concurrency
+        self.jobs = OrderedDict()
+        self.executor = None
+        self.slots = None
+
+    # Copy an upload to a spool file and queue a job importing it into a list
+    async def submit(self, file, batch_size, run, list_id=None):
+        if self.spool_dir:
+            os.makedirs(self.spool_dir, exist_ok=True)
+        size = 0
+        with NamedTemporaryFile(dir=self.spool_dir, prefix="import-", suffix=".json", delete=False) as spool:
+            while chunk := await file.read(IMPORT_CHUNK_SIZE):
+                await asyncio.to_thread(spool.write, chunk)
+                size += len(chunk)
+        job = ImportJob(spool.name, size, batch_size, self.max_errors, list_id)
+        self.jobs[job.id] = job
+        self._forget_finished()
+        job.task = asyncio.create_task(self._run(job, run))
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job):
+        if not job.finished:
+            job.cancel_requested = True
+
+    # Parse the chunk of a job starting at its current offset
+    async def parse(self, job):
+        if self.processes <= 0:
+            return await asyncio.to_thread(parse_import_chunk, job.path, job.offset, job.batch_size, job.rows)
+        if self.executor is None:
+            # Forking a process that runs threads can copy their locks held, so workers are spawned
+            self.executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"))
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, parse_import_chunk, job.path, job.offset, job.batch_size, job.rows)
+
+    async def _run(self, job, run):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.concurrency)
+        try:
+            async with self.slots:
+                if job.cancel_requested:
+                    job.state = "cancelled"
+                    return
+                job.state = "running"
+                job.started_at = time.time()
+                await run(job)
+        except asyncio.CancelledError:
+            job.state = "cancelled"
+            raise
+        except Exception as e:
+            job.state = "failed"
+            job.detail = str(e)
+        finally:
+            if not job.finished:
+                job.state = "completed"
+            job.finished_at = time.time()
+            os.remove(job.path)
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.keep_finished, 0)]:
+            del self.jobs[job_id]
+
+    # Stop the running jobs and the process pool, on shutdown
+    async def close(self):
+        tasks = [job.task for job in self.jobs.values() if job.task and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
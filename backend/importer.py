@@ -0,0 +1,227 @@
+import codecs
+import json
+from typing import Annotated, List
+
+from pydantic import ConfigDict, StringConstraints, TypeAdapter, ValidationError
+# pydantic only accepts typing_extensions' TypedDict before Python 3.12.
+from typing_extensions import TypedDict
+
+from storage import DUPLICATE_TITLE
+
+# Size of each chunk read from an uploaded file.
+IMPORT_CHUNK_SIZE = 64 * 1024
+
+# Largest single array item the parser will buffer while waiting for more data.
+MAX_ITEM_SIZE = 1024 * 1024
+
+
+# Incremental parser for a top level JSON array.
+# Text is fed in chunks and complete items are returned as soon as they are parsed,
+# so an upload never has to be held in memory or decoded in one go.
+# A parser created with resume=True continues an array right after one of its items.
+# consumed_bytes counts the UTF-8 bytes of the text parsed so far, a BOM excluded.
+class JSONArrayParser:
+    def __init__(self, resume=False):
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._buffer = ""
+        # One of "start", "item_or_end", "item", "comma_or_end" or "done".
+        self._state = "comma_or_end" if resume else "start"
+        self.consumed_bytes = 0
+
+    @property
+    def done(self):
+        return self._state == "done"
+
+    # Parse the data fed so far, returning at most limit items
+    def feed(self, data, limit=None):
+        if isinstance(data, bytes):
+            data = self._text_decoder.decode(data)
+        self._buffer += data
+        return self._parse(final=False, limit=limit)
+
+    def close(self, limit=None):
+        self._buffer += self._text_decoder.decode(b"", final=True)
+        items = self._parse(final=True, limit=limit)
+        if self._state != "done" and (limit is None or len(items) < limit):
+            raise ValueError("Unexpected end of JSON array")
+        return items
+
+    def _parse(self, final, limit=None):
+        items = []
+        buffer = self._buffer
+        pos = 0
+        while limit is None or len(items) < limit:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos == len(buffer):
+                break
+
+            char = buffer[pos]
+            if self._state == "done":
+                raise ValueError("Unexpected data after JSON array")
+            if self._state == "start":
+                if char != "[":
+                    raise ValueError("Expected a JSON array")
+                self._state = "item_or_end"
+                pos += 1
+            elif char == "]" and self._state in ("item_or_end", "comma_or_end"):
+                self._state = "done"
+                pos += 1
+            elif char == "," and self._state == "comma_or_end":
+                self._state = "item"
+                pos += 1
+            elif self._state == "comma_or_end":
+                raise ValueError("Expected ',' or ']' in JSON array")
+            else:
+                try:
+                    item, end = self._decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if final:
+                        raise ValueError("Invalid JSON in array")
+                    if len(buffer) - pos > MAX_ITEM_SIZE:
+                        raise ValueError("JSON array item is too large")
+                    break
+                # A value that runs up to the end of the buffer (a number for example)
+                # may continue in the next chunk.
+                if end == len(buffer) and not final:
+                    break
+                items.append(item)
+                self._state = "comma_or_end"
+                pos = end
+
+        self.consumed_bytes += len(buffer[:pos].encode("utf-8"))
+        self._buffer = buffer[pos:]
+        return items
+
+
+# Parse a JSON array from an uploaded file, yielding items in batches.
+async def iter_json_batches(file, batch_size, chunk_size=IMPORT_CHUNK_SIZE):
+    parser = JSONArrayParser()
+    batch = []
+    while True:
+        chunk = await file.read(chunk_size)
+        items = parser.feed(chunk) if chunk else parser.close()
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if not chunk:
+            break
+    if batch:
+        yield batch
+
+
+# Parse at most max_items items of the JSON array in a file, starting at a byte offset
+# returned by an earlier call (0 for the start of the array). Each call only needs the
+# offset, so consecutive chunks can be parsed by different processes.
+# Returns the items, the offset to continue from and whether the array has ended.
+def read_json_items(path, offset, max_items, chunk_size=IMPORT_CHUNK_SIZE):
+    items = []
+    parser = JSONArrayParser(resume=offset > 0)
+    with open(path, "rb") as fileobj:
+        if offset == 0 and fileobj.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8:
+            offset = len(codecs.BOM_UTF8)
+        fileobj.seek(offset)
+        while len(items) < max_items and not parser.done:
+            chunk = fileobj.read(chunk_size)
+            if chunk:
+                items += parser.feed(chunk, limit=max_items - len(items))
+            else:
+                items += parser.close(limit=max_items - len(items))
+                break
+    return items, offset + parser.consumed_bytes, parser.done
+
+
+# Outcome of an import: the rows inserted, updated and rejected, and the (row, detail) errors
+# of every rejected row, or of the first max_errors when it is set.
+class ImportReport:
+    def __init__(self, max_errors=0):
+        self.max_errors = max_errors
+        self.counts = {"inserted": 0, "updated": 0, "rejected": 0}
+        self.errors = []
+
+    # Rejected rows left out of errors, only ever above 0 when max_errors is set
+    @property
+    def errors_omitted(self):
+        return self.counts["rejected"] - len(self.errors)
+
+    def reject(self, errors):
+        self.counts["rejected"] += len(errors)
+        if self.max_errors:
+            errors = errors[:max(self.max_errors - len(self.errors), 0)]
+        self.errors += [{"row": row, "detail": detail} for row, detail in errors]
+
+
+# Schema of an imported row: an id and the fields of ShowCreate, with exactly these types.
+# Other fields are kept as they are. Rows are checked a whole batch per call, so the checks
+# run in pydantic's compiled validator rather than in a Python loop per row.
+class ImportedShow(TypedDict):
+    id: Annotated[str, StringConstraints(pattern=r"^[0-9a-fA-F]{24}$")]
+    title: str
+    status: str
+    current_episode: int
+
+
+IMPORTED_ROWS = TypeAdapter(List[ImportedShow], config=ConfigDict(strict=True))
+
+
+# Reason a row failed the schema, from its pydantic errors
+def row_error_detail(errors):
+    details = []
+    for error in errors:
+        field = ".".join(str(part) for part in error["loc"][1:])
+        if error["type"] == "string_pattern_mismatch":
+            details.append(f"{field}: Not an ObjectId")
+        else:
+            details.append(f"{field}: {error['msg']}" if field else error["msg"])
+    return "; ".join(details)
+
+
+# Split imported rows into the (row, show) pairs that match the schema and the (row, detail)
+# errors of the others. Rows are numbered from first_row, their position in the imported array.
+# Each batch is checked on its own, so batches can be checked by different processes.
+def validate_import_rows(rows, first_row=0):
+    failed = {}
+    try:
+        IMPORTED_ROWS.validate_python(rows)
+    except ValidationError as e:
+        for error in e.errors(include_url=False, include_input=False):
+            failed.setdefault(error["loc"][0], []).append(error)
+
+    shows = []
+    errors = []
+    for index, show in enumerate(rows):
+        if not isinstance(show, dict):
+            errors.append((first_row + index, "Not a JSON object"))
+        elif index in failed:
+            errors.append((first_row + index, row_error_detail(failed[index])))
+        else:
+            shows.append((first_row + index, show))
+    return shows, errors
+
+
+# Rows repeating the id or the title of an earlier row of the same file.
+# An import keeps one for its whole file, after its batches are checked against the schema.
+# Only the first of the rows sharing an id or a title is imported.
+class DuplicateRows:
+    def __init__(self):
+        self.ids = set()
+        self.titles = set()
+
+    # Split (row, show) pairs into the pairs to write and the (row, detail) errors of the duplicates
+    def remove(self, rows):
+        shows = []
+        errors = []
+        for row, show in rows:
+            show_id = show["id"].lower()
+            if show_id in self.ids:
+                errors.append((row, "Duplicate id in the file"))
+            elif show["title"] in self.titles:
+                errors.append((row, DUPLICATE_TITLE))
+            else:
+                self.ids.add(show_id)
+                self.titles.add(show["title"])
+                shows.append((row, show))
+        return shows, errors
@@ -1,163 +1,27 @@
+import asyncio
 import json
-import os
-from fastapi.testclient import TestClient
+from bson import ObjectId
 from httpx import AsyncClient
-from sqlalchemy import create_engine, Column, Integer, String
-from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.ext.declarative import declarative_base
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
-from typing import List
+from main import app, read_cache, shows_version
+from sqlite_storage import SQLiteShowRepository
+from storage import ListReplacedError
 import pytest
 
 
-# SQLAlchemy setup
-DATABASE_URL = "sqlite:///./test.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-# Pydantic models
-class ShowBase(BaseModel):
-    title: str
-    status: str
-    current_episode: int
-
-class Show(ShowBase):
-    id: int
-
-    class Config:
-        from_attributes = True
-
-class ShowCreate(BaseModel):
-    title: str
-    status: str
-    current_episode: int
-
-class ShowUpdate(BaseModel):
-    title: str
-    status: str
-    current_episode: int
-
-# SQLAlchemy model
-class DBShow(Base):
-    __tablename__ = "shows"
-    id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True)
-    status = Column(String)
-    current_episode = Column(Integer)
-
-# FastAPI setup
-app = FastAPI()
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-# Helper functions to help handling SQLite format.
-@app.post("/create-shows-list/", status_code=status.HTTP_201_CREATED)
-def create_shows_list(db: Session = Depends(get_db)):
-    try:
-        # Delete existing shows
-        db.query(DBShow).delete()
-        db.commit()
-
-        return {"detail": "Empty shows list created"}
-
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    
-@app.post("/shows/", response_model=Show, status_code=status.HTTP_201_CREATED)
-def create_show(show: ShowCreate, db: Session = Depends(get_db)):
-    db_show = db.query(DBShow).filter(DBShow.title == show.title).first()
-    if db_show:
-        raise HTTPException(status_code=400, detail="Show already exists")
-    db_show = DBShow(**show.dict())
-    db.add(db_show)
-    db.commit()
-    db.refresh(db_show)
-    return Show(**db_show.__dict__)
-
-@app.get("/shows/{show_id}", response_model=Show)
-def read_show(show_id: int, db: Session = Depends(get_db)):
-    db_show = db.query(DBShow).filter(DBShow.id == show_id).first()
-    if db_show is None:
-        raise HTTPException(status_code=404, detail="Show not found")
-    return db_show
-
-@app.get("/shows/", response_model=List[Show])
-def read_shows(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    shows = db.query(DBShow).offset(skip).limit(limit).all()
-    return shows
-
-@app.put("/shows/{show_id}", response_model=Show)
-def update_show(show_id: int, show: ShowUpdate, db: Session = Depends(get_db)):
-    db_show = db.query(DBShow).filter(DBShow.id == show_id).first()
-    if db_show is None:
-        raise HTTPException(status_code=404, detail="Show not found")
-    if db.query(DBShow).filter(DBShow.title == show.title).first() and db_show.title != show.title:
-        raise HTTPException(status_code=400, detail="Another show with the same title already exists")
-    for key, value in show.dict().items():
-        setattr(db_show, key, value)
-    db.commit()
-    db.refresh(db_show)
-    return db_show
-
-@app.delete("/shows/{show_id}", response_model=Show)
-def delete_show(show_id: int, db: Session = Depends(get_db)):
-    db_show = db.query(DBShow).filter(DBShow.id == show_id).first()
-    if db_show is None:
-        raise HTTPException(status_code=404, detail="Show not found")
-    db.delete(db_show)
-    db.commit()
-    return db_show
-
-@app.get("/export/", status_code=status.HTTP_200_OK)
-def export_shows(db: Session = Depends(get_db)):
-    shows = db.query(DBShow).all()
-    shows_dict = [show.__dict__ for show in shows]
-    for show in shows_dict:
-        show.pop('_sa_instance_state', None)
-    
-    with open("shows.json", "w") as f:
-        json.dump(shows_dict, f, indent=4)
-    
-    response = FileResponse("shows.json", media_type="application/json")
-    response.headers["Content-Disposition"] = "attachment; filename=shows.json"
-    
-    return response
-
-
-@app.post("/import/", status_code=status.HTTP_201_CREATED)
-def import_shows(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    content = file.file.read()
-    shows_dict = json.loads(content)
-    
-    for show_data in shows_dict:
-        show = db.query(DBShow).filter(DBShow.id == show_data["id"]).first()
-        if not show:
-            new_show = DBShow(**show_data)
-            db.add(new_show)
-        else:
-            for key, value in show_data.items():
-                setattr(show, key, value)
-    
-    db.commit()
-    return {"detail": "Shows imported successfully"}
-
-# Ensure tables are created
-Base.metadata.create_all(bind=engine)
-
-# Test setup
-client = TestClient(app)
+# The app under test keeps its shows in a SQLite file
+repository = SQLiteShowRepository("./test.db")
+
+@pytest.fixture(autouse=True)
+def use_repository():
+    app.state.repository = repository
+    read_cache.clear()
+    asyncio.run(repository.start())
+    asyncio.run(shows_version.load(repository))
+    yield
+    asyncio.run(repository.close())
 
 @pytest.mark.asyncio
-async def test_workflow():
+async def test_workflow(tmp_path):
     async with AsyncClient(app=app, base_url="http://test") as client:
         # Step 1: Create an empty list of shows
         response = await client.post("/create-shows-list/")
@@ -198,10 +62,10 @@ async def test_workflow():
         shows_to_import = [
             {"id": str(created_show["id"]), "title": "Test Show", "status": "watching", "current_episode": 1},
         ]
-        with open("shows.json", "w") as f:
-            json.dump(shows_to_import, f)
+        upload = tmp_path / "shows.json"
+        upload.write_text(json.dumps(shows_to_import))
 
-        with open("shows.json", "rb") as f:
+        with open(upload, "rb") as f:
             response = await client.post("/import/", files={"file": ("shows.json", f, "application/json")})
         assert response.status_code == 201
         assert response.json()["detail"] == "Shows imported successfully"
@@ -210,15 +74,12 @@ async def test_workflow():
         response = await client.get("/export/")
         assert response.status_code == 200  # Updated to check for 200 OK
         assert response.headers["content-type"] == "application/json"
-        assert "attachment; filename=shows.json" in response.headers["content-disposition"]
-
-        with open("shows.json", "r") as f:
-            exported_data = json.load(f)
-            assert isinstance(exported_data, list)
-            assert all(isinstance(show, dict) for show in exported_data)
-            assert len(exported_data) == 1
+        assert 'attachment; filename="shows.json"' in response.headers["content-disposition"]
 
-        os.remove("shows.json")  # Clean up the file
+        exported_data = response.json()
+        assert isinstance(exported_data, list)
+        assert all(isinstance(show, dict) for show in exported_data)
+        assert len(exported_data) == 1
 
 
 @pytest.mark.asyncio
@@ -237,7 +98,7 @@ async def test_error_handling():
         # Step 2: Try to create a show with the same title (should fail)
         response = await client.post("/shows/", json=show_data)
         assert response.status_code == 400
-        assert response.json()["detail"] == "Show already exists"
+        assert response.json()["detail"] == "Show with this title already exists"
 
         # Step 3: Create another show with a different title
         new_show_data = {"title": "New Show", "status": "watching", "current_episode": 1}
@@ -249,4 +110,197 @@ async def test_error_handling():
         update_data = {"title": "Test Show", "status": "completed", "current_episode": 10}
         response = await client.put(f"/shows/{new_created_show['id']}", json=update_data)
         assert response.status_code == 400
-        assert response.json()["detail"] == "Another show with the same title already exists"
+        assert response.json()["detail"] == "Show with this title already exists"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_creates_of_a_title_make_one_show():
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        await client.post("/create-shows-list/")
+        show = {"title": "Race Show", "status": "watching", "current_episode": 1}
+        responses = await asyncio.gather(*(client.post("/shows/", json=show) for attempt in range(5)))
+        assert sorted(response.status_code for response in responses) == [201, 400, 400, 400, 400]
+        assert [show["title"] for show in (await client.get("/shows/")).json()] == ["Race Show"]
+
+    # The unique index is part of the schema created at startup
+    unique_columns = []
+    async with repository._reading() as connection:
+        for seq, name, unique, origin, partial in await connection.execute_fetchall("PRAGMA index_list(shows)"):
+            if unique:
+                unique_columns.append([column for seqno, cid, column in await connection.execute_fetchall(f"PRAGMA index_info({name})")])
+    assert ["list_id", "title"] in unique_columns
+
+
+@pytest.mark.asyncio
+async def test_cursor_pages_and_batches():
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.post("/create-shows-list/")
+        assert response.status_code == 201
+
+        shows = [{"title": f"Show {i}", "status": "watching" if i % 2 else "completed", "current_episode": i % 3} for i in range(7)]
+        response = await client.post("/shows/batch", json=shows)
+        assert all(item["status_code"] == 201 for item in response.json()["results"])
+
+        # Walking the cursor pages returns every show once, in sort order
+        titles = []
+        params = {"sort": "current_episode", "order": "desc", "limit": 3}
+        while True:
+            response = await client.get("/shows/", params=params)
+            titles += [show["title"] for show in response.json()]
+            if "x-next-cursor" not in response.headers:
+                break
+            params["cursor"] = response.headers["x-next-cursor"]
+        expected = sorted(shows, key=lambda show: show["current_episode"], reverse=True)
+        assert sorted(titles) == sorted(show["title"] for show in shows)
+        assert [show["current_episode"] for show in expected] == [int(title.split()[1]) % 3 for title in titles]
+
+        response = await client.get("/shows/", params={"status": "completed", "sort": "title", "order": "desc"})
+        assert [show["title"] for show in response.json()] == ["Show 6", "Show 4", "Show 2", "Show 0"]
+        response = await client.get("/shows/", params={"sort": "status", "limit": 4})
+        assert [show["status"] for show in response.json()] == ["completed"] * 4
+
+        # Each item of a batch succeeds or fails on its own
+        ids = [show["id"] for show in (await client.get("/shows/", params={"sort": "title", "limit": 2})).json()]
+        response = await client.put("/shows/batch", json=[
+            {"id": ids[0], "title": "Show 1", "status": "watching", "current_episode": 0},
+            {"id": ids[1], "title": "Show 1", "status": "completed", "current_episode": 1},
+        ])
+        assert [item["status_code"] for item in response.json()["results"]] == [400, 200]
+        response = await client.post("/shows/batch/get", json={"ids": [ids[1], str(ObjectId())]})
+        assert [item["status_code"] for item in response.json()["results"]] == [200, 404]
+        assert response.json()["results"][0]["show"]["status"] == "completed"
+
+        # A cursor only continues the query it was made for
+        response = await client.get("/shows/", params={"sort": "title", "limit": 3})
+        cursor = response.headers["x-next-cursor"]
+        response = await client.get("/shows/", params={"sort": "title", "limit": 3, "cursor": cursor})
+        assert [show["title"] for show in response.json()] == ["Show 3", "Show 4", "Show 5"]
+        response = await client.get("/shows/", params={"sort": "title", "order": "desc", "cursor": cursor})
+        assert response.status_code == 400
+        response = await client.get("/shows/", params={"sort": "title", "cursor": cursor[:-2]})
+        assert response.status_code == 400
+
+        response = await client.get("/shows/search", params={"q": "show 1"})
+        assert [show["title"] for show in response.json()] == ["Show 1"]
+
+        show_id = response.json()[0]["id"]
+        response = await client.post(f"/shows/{show_id}/progress", json={"increment": 2, "episode": 5})
+        assert response.json()["current_episode"] == 5
+
+        response = await client.get("/shows/stats", params={"verify": True})
+        assert response.json()["total"] == 7 and response.json()["consistent"] is True
+        response = await client.post("/shows/stats/rebuild")
+        assert response.json()["total"] == 7 and response.json()["consistent"] is True
+
+@pytest.mark.asyncio
+async def test_search_and_suggest_read_title_prefixes():
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        await client.post("/create-shows-list/")
+        titles = ["Star Trek", "stargate", "100% Star", "Star_Wars", "Starz", "Superstar"]
+        await client.post("/shows/batch", json=[{"title": title, "status": "watching", "current_episode": 1} for title in titles])
+
+        response = await client.get("/shows/search", params={"q": "STAR"})
+        assert [show["title"] for show in response.json()] == ["Star Trek", "Star_Wars", "stargate", "Starz"]
+        response = await client.get("/shows/suggest", params={"q": "star", "limit": 2})
+        assert response.json() == ["Star Trek", "Star_Wars"]
+        # Characters LIKE would treat as wildcards match themselves
+        assert (await client.get("/shows/suggest", params={"q": "100%"})).json() == ["100% Star"]
+        assert (await client.get("/shows/suggest", params={"q": "star_"})).json() == ["Star_Wars"]
+
+        # Titles of another list are not suggested
+        assert (await client.get("/shows/suggest", params={"q": "star"}, headers={"X-List-Id": "other"})).json() == []
+
+
+@pytest.mark.asyncio
+async def test_export_since():
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        await client.post("/create-shows-list/")
+        response = await client.post("/shows/batch", json=[{"title": f"Sync {i}", "status": "watching", "current_episode": i} for i in range(3)])
+        show_ids = [item["id"] for item in response.json()["results"]]
+        since = (await client.get("/export/")).headers["x-export-since"]
+
+        await client.post("/shows/batch/delete", json={"ids": show_ids[:2]})
+        response = await client.get("/export/", params={"since": since, "format": "csv"})
+        lines = response.text.splitlines()
+        assert lines[0] == "id,title,status,current_episode,rev,updated_at,deleted,deleted_at"
+        assert sorted(line.split(",")[0] for line in lines[1:]) == sorted(show_ids[:2])
+
+@pytest.mark.asyncio
+async def test_lists_are_kept_apart():
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        lists = [{"X-List-Id": "first"}, {"X-List-Id": "second"}]
+        for headers in lists:
+            await client.post("/create-shows-list/", headers=headers)
+            response = await client.post("/shows/", json={"title": "Same Title", "status": "watching", "current_episode": 1}, headers=headers)
+            assert response.status_code == 201
+
+        show_id = (await client.get("/shows/", headers=lists[0])).json()[0]["id"]
+        await client.post(f"/shows/{show_id}/progress", json={"episode": 4}, headers=lists[0])
+        assert (await client.get(f"/shows/{show_id}", headers=lists[1])).status_code == 404
+
+        await client.post("/create-shows-list/", headers=lists[1])
+        assert (await client.get("/shows/", headers=lists[1])).json() == []
+        response = await client.get("/export/", headers=lists[0])
+        assert [show["current_episode"] for show in response.json()] == [4]
+
+@pytest.mark.asyncio
+async def test_import_batch_reports_the_shows_the_storage_rejects():
+    staging = await repository.stage_import()
+    shows = [{"id": str(ObjectId()), "title": title, "status": "watching", "current_episode": 1} for title in ["A", "B", "A"]]
+    counts, errors = await repository.import_batch(shows, staging)
+    await repository.discard_import(staging)
+    assert counts == {"inserted": 2, "updated": 0}
+    assert errors == [(2, "Duplicate title in the file")]
+
+@pytest.mark.asyncio
+async def test_reads_of_unknown_lists_keep_nothing():
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        unknown = {"X-List-Id": f"unread-{ObjectId()}"}
+        assert (await client.get("/shows/", headers=unknown)).json() == []
+        assert (await client.get(f"/shows/{ObjectId()}", headers=unknown)).status_code == 404
+    assert await repository.for_list(unknown["X-List-Id"]).load_version() == (None, 0)
+
+@pytest.mark.asyncio
+async def test_etags_outlive_a_restart_and_change_with_writes():
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        await client.post("/create-shows-list/")
+        show_id = (await client.post("/shows/", json={"title": "Kept Show", "status": "watching", "current_episode": 1})).json()["id"]
+        list_etag = (await client.get("/shows/")).headers["etag"]
+        show_etag = (await client.get(f"/shows/{show_id}")).headers["etag"]
+
+        # The version is stored with the shows, so a restarted worker answers with the same ETags
+        await repository.close()
+        await repository.start()
+        await shows_version.load(repository)
+        read_cache.clear()
+        assert (await client.get("/shows/", headers={"If-None-Match": list_etag})).status_code == 304
+        assert (await client.get(f"/shows/{show_id}", headers={"If-None-Match": show_etag})).status_code == 304
+
+        await client.put(f"/shows/{show_id}", json={"title": "Kept Show", "status": "completed", "current_episode": 3})
+        assert (await client.get("/shows/", headers={"If-None-Match": list_etag})).status_code == 200
+        assert (await client.get(f"/shows/{show_id}", headers={"If-None-Match": show_etag})).status_code == 200
+
+@pytest.mark.asyncio
+async def test_export_reads_the_list_of_a_single_moment():
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        await client.post("/create-shows-list/")
+        await client.post("/shows/batch", json=[{"title": f"Old {i}", "status": "watching", "current_episode": i} for i in range(5)])
+        since = (await client.get("/export/")).headers["x-export-since"]
+
+        shows = repository.iter_shows(batch_size=2)
+        changes = repository.iter_changes(int(since) - 1, batch_size=2)
+        titles = [(await anext(shows))["title"]]
+        await anext(changes)
+
+        # An import replaces the list while both exports are half way through it
+        imported = [{"id": str(ObjectId()), "title": "New", "status": "watching", "current_episode": 1}]
+        response = await client.post("/import/", files={"file": ("shows.json", json.dumps(imported), "application/json")})
+        assert response.status_code == 201
+
+        titles += [show["title"] async for show in shows]
+        assert titles == [f"Old {i}" for i in range(5)]
+        assert len([change async for change in changes]) == 4
+
+        # A delta that starts after the import is answered with an error, not with the new list
+        with pytest.raises(ListReplacedError):
+            await anext(repository.iter_changes(int(since)))
@@ -0,0 +1,313 @@
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from weakref import WeakValueDictionary
+
+from bson import ObjectId
+
+from storage import DEFAULT_LIST, DUPLICATE_TITLE, DuplicateTitleError, ListReplacedError, ShowRepository, advanced_episode, column_value, episode_count, normalize_title, project_show, sort_value, timestamp, tombstone
+
+# Sorted indexes kept over the shows, named by the fields they order on. Every entry is
+# the sort values of those fields followed by the show id, so equal values are in id order.
+MEMORY_INDEXES = [
+    (),
+    ("title",),
+    ("status",),
+    ("current_episode",),
+    ("status", "title"),
+    ("status", "current_episode"),
+    ("title_norm",),
+    ("rev",),
+]
+
+
+# Compares greater than any sort value or id, to find the end of a range of index entries
+class _Last:
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+LAST = _Last()
+
+
+# Shows kept in a dict of this worker, with sorted indexes answering every list query
+# with a binary search. Nothing is persisted, so it suits tests, benchmarks and demos.
+# Each list is a repository of its own, found through the lists dict they all share. A list
+# only joins that dict on its first write; until then requests share it through unsaved,
+# which forgets it once no request holds it, so reads of unknown lists keep nothing.
+class MemoryShowRepository(ShowRepository):
+    name = "memory"
+
+    def __init__(self, list_id=DEFAULT_LIST, lists=None, unsaved=None):
+        self.list_id = list_id
+        if lists is None:
+            lists = {list_id: self}
+        self.lists = lists
+        self.unsaved = unsaved if unsaved is not None else WeakValueDictionary()
+        self.shows = {}
+        self.titles = {}
+        self.indexes = {fields: [] for fields in MEMORY_INDEXES}
+        # Deleted show ids, with the rev and time of their deletion
+        self.tombstones = {}
+        self.reset_rev = 0
+        # [count, episodes] of each status, kept by _add and _remove
+        self.stats = {}
+        self.epoch = None
+        self.version = 0
+
+    def for_list(self, list_id):
+        repository = self.lists.get(list_id) or self.unsaved.get(list_id)
+        if repository is None:
+            repository = self.unsaved[list_id] = MemoryShowRepository(list_id, self.lists, self.unsaved)
+        return repository
+
+    def _entry(self, fields, show_id, show):
+        return tuple(sort_value(show.get(field)) for field in fields) + (show_id,)
+
+    def _add(self, show_id, show):
+        if show.get("title") is not None:
+            self.titles[sort_value(show["title"])] = show_id
+        if isinstance(show.get("title"), str):
+            show["title_norm"] = normalize_title(show["title"])
+        self.shows[show_id] = show
+        for fields, index in self.indexes.items():
+            insort(index, self._entry(fields, show_id, show))
+        self._count(show, 1)
+
+    def _remove(self, show_id):
+        show = self.shows.pop(show_id)
+        if show.get("title") is not None and self.titles.get(sort_value(show["title"])) == show_id:
+            del self.titles[sort_value(show["title"])]
+        for fields, index in self.indexes.items():
+            del index[bisect_left(index, self._entry(fields, show_id, show))]
+        self._count(show, -1)
+        return show
+
+    # Add a show to the statistics of its status, or take it away with sign -1
+    def _count(self, show, sign):
+        key = column_value(show.get("status"))
+        entry = self.stats.setdefault(key, [0, 0])
+        entry[0] += sign
+        entry[1] += sign * episode_count(show.get("current_episode"))
+        if entry[0] == 0:
+            del self.stats[key]
+
+    # Whether storing this title under show_id would break the unique titles
+    def _title_taken(self, title, show_id):
+        if title is None:
+            return False
+        owner = self.titles.get(sort_value(title))
+        return owner is not None and owner != show_id
+
+    def _read(self, show_id, show):
+        read = {key: value for key, value in show.items() if key != "title_norm"}
+        read["id"] = show_id
+        return read
+
+    def _replace(self, show_id, show):
+        if show_id in self.shows:
+            self._remove(show_id)
+        self._add(show_id, show)
+
+    async def load_version(self):
+        return self.epoch, self.version
+
+    async def allocate_version(self):
+        if self.epoch is None:
+            self.epoch = str(ObjectId())
+            self.lists[self.list_id] = self
+            self.unsaved.pop(self.list_id, None)
+        self.version += 1
+        return self.epoch, self.version
+
+    async def commit_version(self):
+        self.version += 1
+
+    async def clear(self, rev=0):
+        self.shows.clear()
+        self.titles.clear()
+        for index in self.indexes.values():
+            index.clear()
+        self.tombstones.clear()
+        self.stats.clear()
+        self.reset_rev = rev
+
+    async def load_reset_rev(self):
+        return self.reset_rev
+
+    async def create(self, show, rev):
+        if self._title_taken(show["title"], None):
+            raise DuplicateTitleError(show["title"])
+        show_id = str(ObjectId())
+        self._add(show_id, {**show, "rev": rev})
+        return self._read(show_id, self.shows[show_id])
+
+    async def get(self, show_id):
+        show = self.shows.get(show_id)
+        return self._read(show_id, show) if show is not None else None
+
+    async def get_many(self, show_ids):
+        return {show_id: self._read(show_id, self.shows[show_id]) for show_id in show_ids if show_id in self.shows}
+
+    async def list_shows(self, status=None, sort=None, order="asc", after=None, skip=0, limit=10, projected=False):
+        fields = ("status",) if status is not None else ()
+        if sort and sort not in fields:
+            fields += (sort,)
+        index = self.indexes[fields]
+        prefix = (sort_value(status),) if status is not None else ()
+        start = bisect_left(index, prefix)
+        end = bisect_left(index, prefix + (LAST,)) if prefix else len(index)
+
+        if after:
+            position = prefix + ((sort_value(after.get("key")),) if len(fields) > len(prefix) else ()) + (after["id"],)
+            if order == "desc":
+                end = bisect_left(index, position, start, end)
+            else:
+                start = bisect_right(index, position, start, end)
+
+        # Walk the range from the requested end without copying it.
+        skip = max(skip, 0)
+        if order == "desc":
+            positions = range(end - 1 - skip, start - 1, -1)
+        else:
+            positions = range(start + skip, end)
+        if limit:
+            positions = positions[:abs(limit)]
+
+        if projected:
+            return [project_show(index[position][-1], self.shows[index[position][-1]]) for position in positions]
+        return [self._read(index[position][-1], self.shows[index[position][-1]]) for position in positions]
+
+    async def update(self, show_id, fields, rev):
+        show = self.shows.get(show_id)
+        if show is None:
+            return None
+        if self._title_taken(fields["title"], show_id):
+            raise DuplicateTitleError(fields["title"])
+        self._replace(show_id, {**show, **fields, "rev": rev})
+        return self._read(show_id, self.shows[show_id])
+
+    async def advance_episode(self, show_id, increment, at_least, rev, updated_at):
+        show = self.shows.get(show_id)
+        if show is None:
+            return None
+        episode = advanced_episode(show.get("current_episode"), increment, at_least)
+        self._replace(show_id, {**show, "current_episode": episode, "updated_at": updated_at, "rev": rev})
+        return self._read(show_id, self.shows[show_id])
+
+    async def delete(self, show_id, rev):
+        if show_id not in self.shows:
+            return None
+        self.tombstones[show_id] = (rev, timestamp())
+        return self._read(show_id, self._remove(show_id))
+
+    async def create_many(self, shows, rev):
+        created = {}
+        errors = {}
+        for index, show in enumerate(shows):
+            try:
+                created[index] = await self.create(show, rev)
+            except DuplicateTitleError:
+                errors[index] = (400, "Show with this title already exists")
+        return created, errors
+
+    async def update_many(self, updates, rev):
+        errors = {}
+        for index, (show_id, fields) in enumerate(updates):
+            try:
+                await self.update(show_id, fields, rev)
+            except DuplicateTitleError:
+                errors[index] = (400, "Show with this title already exists")
+        return errors
+
+    async def delete_many(self, show_ids, rev):
+        deleted_at = timestamp()
+        for show_id in show_ids:
+            if show_id in self.shows:
+                self._remove(show_id)
+                self.tombstones[show_id] = (rev, deleted_at)
+
+    # The staging area is a repository of its own, whose data replaces this one's on commit
+    async def stage_import(self):
+        return MemoryShowRepository(self.list_id)
+
+    async def import_batch(self, shows, staging):
+        return staging._import(shows)
+
+    async def commit_import(self, staging, rev):
+        for show in staging.shows.values():
+            show["rev"] = rev
+        staging.indexes[("rev",)] = sorted(staging._entry(("rev",), show_id, show) for show_id, show in staging.shows.items())
+        self.shows, self.titles, self.indexes, self.stats = staging.shows, staging.titles, staging.indexes, staging.stats
+        self.tombstones.clear()
+        self.reset_rev = rev
+
+    async def discard_import(self, staging):
+        pass
+
+    def _import(self, shows):
+        counts = {"inserted": 0, "updated": 0}
+        errors = []
+        for position, show in enumerate(shows):
+            show_id = str(ObjectId(show["id"]))
+            if self._title_taken(show.get("title"), show_id):
+                errors.append((position, DUPLICATE_TITLE))
+                continue
+            counts["updated" if show_id in self.shows else "inserted"] += 1
+            self._replace(show_id, {**{key: value for key, value in show.items() if key not in ("id", "title_norm")}, "rev": 0})
+        return counts, errors
+
+    # The shows are copied before the first one is exported, which makes the export a snapshot
+    async def iter_shows(self, projected=False, batch_size=1000):
+        for show_id, show in list(self.shows.items()):
+            if projected:
+                yield project_show(show_id, show)
+            else:
+                exported = {key: value for key, value in show.items() if key not in ("rev", "title_norm")}
+                exported["id"] = show_id
+                yield exported
+
+    # The rev index is walked from the first show written after since. Every change is collected
+    # before the first one is exported, which makes the export a snapshot.
+    async def iter_changes(self, since, batch_size=1000):
+        if since < self.reset_rev:
+            raise ListReplacedError(self.list_id)
+        index = self.indexes[("rev",)]
+        changes = [self._read(show_id, self.shows[show_id]) for rev, show_id in index[bisect_left(index, (sort_value(since + 1),)):]]
+        deleted = sorted((rev, show_id, deleted_at) for show_id, (rev, deleted_at) in self.tombstones.items() if rev > since)
+        changes += [tombstone(show_id, rev, deleted_at) for rev, show_id, deleted_at in deleted]
+        for change in changes:
+            yield change
+
+    # Ids of the shows whose normalized title starts with the query, in title_norm order
+    def _prefix_matches(self, query):
+        index = self.indexes[("title_norm",)]
+        for position in range(bisect_left(index, ((2, query),)), len(index)):
+            title_norm, show_id = index[position]
+            if not title_norm[1].startswith(query):
+                break
+            yield show_id
+
+    async def search(self, query, limit):
+        return [self._read(show_id, self.shows[show_id]) for show_id in islice(self._prefix_matches(query), limit)]
+
+    async def suggest(self, query, limit):
+        return [self.shows[show_id]["title"] for show_id in islice(self._prefix_matches(query), limit)]
+
+    async def load_stats(self):
+        return [{"status": status, "count": count, "episodes": episodes} for status, (count, episodes) in self.stats.items()]
+
+    async def compute_stats(self):
+        totals = {}
+        for show in self.shows.values():
+            key = column_value(show.get("status"))
+            count, episodes = totals.get(key, (0, 0))
+            totals[key] = (count + 1, episodes + episode_count(show.get("current_episode")))
+        return [{"status": status, "count": count, "episodes": episodes} for status, (count, episodes) in totals.items()]
+
+    async def rebuild_stats(self):
+        stats = await self.compute_stats()
+        self.stats = {row["status"]: [row["count"], row["episodes"]] for row in stats}
+        return stats
@@ -0,0 +1,695 @@
+import asyncio
+import copy
+import logging
+import re
+import time
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, DeleteMany, IndexModel, InsertOne, ReplaceOne, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+
+from events import show_event_data
+from metrics import registry
+from storage import DEFAULT_LIST, DUPLICATE_TITLE, ChangeStreamUnavailable, DuplicateTitleError, ListReplacedError, ShowRepository, TitlesNotUniqueError, advanced_episode, column_value, episode_count, normalize_title, project_show, timestamp, tombstone
+
+logger = logging.getLogger(__name__)
+
+# The unique title index is what enforces unique show titles.
+TITLE_UNIQUE_INDEX = IndexModel([("title", ASCENDING)], name="title_unique", unique=True)
+
+# Seconds a list whose unique title index could not be built refuses writes before they try
+# to build it again.
+PREPARE_RETRY_SECONDS = 30
+
+# Indexes of the shows collection, created at startup. Besides the unique titles they back
+# every status filter and sort of GET /shows/, so a page never needs an in-memory sort.
+SHOW_INDEXES = [
+    TITLE_UNIQUE_INDEX,
+    IndexModel([("status", ASCENDING), ("_id", ASCENDING)], name="status_id"),
+    IndexModel([("status", ASCENDING), ("title", ASCENDING)], name="status_title"),
+    IndexModel([("current_episode", ASCENDING), ("_id", ASCENDING)], name="current_episode_id"),
+    IndexModel(
+        [("status", ASCENDING), ("current_episode", ASCENDING), ("_id", ASCENDING)],
+        name="status_current_episode_id",
+    ),
+    # Lowercased title for case-insensitive search. Including the title makes suggestions covered queries.
+    IndexModel([("title_norm", ASCENDING), ("title", ASCENDING)], name="title_norm_title"),
+    # Shows written after a revision, for incremental exports.
+    IndexModel([("rev", ASCENDING), ("_id", ASCENDING)], name="rev_id"),
+]
+
+# Indexes of the tombstones collection, which keeps the id, rev and time of deleted shows.
+TOMBSTONE_INDEXES = [
+    IndexModel([("rev", ASCENDING), ("_id", ASCENDING)], name="rev_id"),
+]
+
+# Fields kept for the database's own use. Reads leave out the search key, exports both.
+READ_FIELDS = {"title_norm": 0}
+INTERNAL_FIELDS = {"rev": 0, "title_norm": 0}
+
+# Fields the statistics are computed from.
+STATS_FIELDS = {"status": 1, "current_episode": 1}
+
+# Count and episode total of each status, as episode_count counts them. Used to rebuild the
+# stats collection, which the writes otherwise keep up to date with $inc.
+STATS_PIPELINE = [
+    {"$group": {
+        "_id": "$status",
+        "count": {"$sum": 1},
+        "episodes": {"$sum": {"$cond": [{"$isNumber": "$current_episode"}, "$current_episode", 0]}},
+    }},
+]
+
+# Collections of the shows of a list, "shows.<list_id>", and of the default list, "shows".
+# The change stream watches the database for these.
+LIST_COLLECTION = re.compile(r"shows(?:\.(?P<list_id>[A-Za-z0-9_-]+))?")
+LIST_COLLECTION_FILTER = {"$regex": r"^shows(\.|$)"}
+
+# Projection returning shows exactly as the Show model, used by the fast path.
+SHOW_PROJECTION = {"_id": 0, "id": {"$toString": "$_id"}, "title": 1, "status": 1, "current_episode": 1}
+
+# Fields of the Show model, for exports on the fast path, which keep _id to page on it.
+SHOW_FIELDS_PROJECTION = {"title": 1, "status": 1, "current_episode": 1}
+
+
+# Counts connection pool events so the pool can be sized from real traffic.
+class PoolStats(monitoring.ConnectionPoolListener):
+    def __init__(self, max_pool_size, min_pool_size):
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checked_in = 0
+        self.check_out_failed = 0
+        self.cleared = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.closed += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.check_out_failed += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_in += 1
+
+    def snapshot(self):
+        return {
+            "max_pool_size": self.max_pool_size,
+            "min_pool_size": self.min_pool_size,
+            "open_connections": self.created - self.closed,
+            "in_use": self.checked_out - self.checked_in,
+            "connections_created": self.created,
+            "connections_closed": self.closed,
+            "check_outs": self.checked_out,
+            "check_out_failures": self.check_out_failed,
+            "pool_clears": self.cleared,
+        }
+
+
+# Mongo commands mostly take well under a millisecond, so the buckets start lower than HTTP ones.
+COMMAND_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+# Times every command the client sends, by command name, for GET /metrics.
+class CommandStats(monitoring.CommandListener):
+    def __init__(self):
+        self.durations = registry.histogram(
+            "mongodb_command_duration_seconds", "Duration of MongoDB commands, by command.", ("command",), COMMAND_BUCKETS
+        )
+        self.failures = registry.counter("mongodb_command_failures_total", "Failed MongoDB commands, by command.", ("command",))
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.durations.observe(event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event):
+        self.durations.observe(event.duration_micros / 1e6, event.command_name)
+        self.failures.inc(event.command_name)
+
+
+# Map the _id of a stored document to the id of a show
+def to_show(document):
+    document["id"] = str(document.pop("_id"))
+    return document
+
+
+# Per item error of a failed bulk write
+def bulk_write_error(error):
+    if error["code"] == 11000:
+        return 400, "Show with this title already exists"
+    return 500, error["errmsg"]
+
+
+# Sort specification of a list query. Titles are unique so they need no tie-breaker,
+# every other key is followed by _id to give a stable order.
+def list_sort(sort, order):
+    direction = DESCENDING if order == "desc" else ASCENDING
+    if sort == "title":
+        return [("title", direction)]
+    if sort:
+        return [(sort, direction), ("_id", direction)]
+    return [("_id", direction)]
+
+
+# Condition selecting the shows after a cursor position in the given sort order
+def after_cursor(position, sort, order):
+    after = "$lt" if order == "desc" else "$gt"
+    show_id = ObjectId(position["id"])
+    if not sort:
+        return {"_id": {after: show_id}}
+    if sort == "title":
+        return {"title": {after: position["key"]}}
+    # The inclusive range on the sort key keeps the index bounds tight.
+    return {
+        sort: {after + "e": position["key"]},
+        "$or": [{sort: {after: position["key"]}}, {"_id": {after: show_id}}],
+    }
+
+
+# List a shows collection belongs to, or None for any other collection
+def collection_list(name):
+    match = LIST_COLLECTION.fullmatch(name)
+    if match is None:
+        return None
+    return match["list_id"] or DEFAULT_LIST
+
+
+# Shows stored in a MongoDB database, through one pooled client per worker.
+# Every list has collections of its own, named after it: its shows, tombstones and stats.
+# Imported shows keep their ids, which may be the same in two lists, and an import replaces
+# its list's collection with renameCollection. The version counter lives in the meta
+# collection, one document per list, so all workers share it.
+class MongoShowRepository(ShowRepository):
+    name = "mongo"
+
+    def __init__(self, url, database_name, max_pool_size=100, min_pool_size=0, max_idle_time_ms=60000, server_selection_timeout_ms=5000):
+        self.url = url
+        self.database_name = database_name
+        self.client_options = {
+            "maxPoolSize": max_pool_size,
+            "minPoolSize": min_pool_size,
+            "maxIdleTimeMS": max_idle_time_ms,
+            "serverSelectionTimeoutMS": server_selection_timeout_ms,
+        }
+        self.stats = PoolStats(max_pool_size, min_pool_size)
+        self.commands = CommandStats()
+        self.client = None
+        self.db = None
+        # Lists whose indexes this worker has created, and the (time, detail) of those whose
+        # stored shows share a title, so the unique title index could not be built
+        self.prepared = set()
+        self.unprepared = {}
+
+    def for_list(self, list_id):
+        repository = copy.copy(self)
+        repository.list_id = list_id
+        return repository
+
+    # Name of a collection of this repository's list
+    def _name(self, kind):
+        return kind if self.list_id == DEFAULT_LIST else f"{kind}.{self.list_id}"
+
+    @property
+    def shows(self):
+        return self.db[self._name("shows")]
+
+    @property
+    def tombstones(self):
+        return self.db[self._name("tombstones")]
+
+    @property
+    def show_stats(self):
+        return self.db[self._name("stats")]
+
+    async def start(self):
+        self.client = AsyncIOMotorClient(self.url, event_listeners=[self.stats, self.commands], **self.client_options)
+        self.db = self.client[self.database_name]
+        await self.migrate_legacy_shows()
+        await self.ensure_indexes()
+        await self.ensure_stats()
+
+    async def close(self):
+        if self.client:
+            self.client.close()
+
+    # Move the shows of deployments from before the shared client into the shows collection.
+    # Those indexed the database by its name twice, so their shows are in "<database>.shows".
+    # The collection is only renamed while shows is still empty, so it runs once; when another
+    # worker renamed it first, the rename finds nothing and is skipped.
+    async def migrate_legacy_shows(self):
+        legacy = f"{self.database_name}.shows"
+        try:
+            if legacy not in await self.db.list_collection_names(filter={"name": legacy}):
+                return
+            if await self.db.shows.find_one({}, {"_id": 1}) is not None:
+                logger.warning("Both %s and shows hold shows, leaving %s as it is", legacy, legacy)
+                return
+            await self.db[legacy].rename("shows", dropTarget=True)
+            logger.info("Moved the shows of %s to shows", legacy)
+        except PyMongoError as e:
+            logger.error("Could not move the shows of %s to shows: %s", legacy, e)
+
+    # Create the declared indexes, which is a no-op for indexes that already exist,
+    # and fill in the search key of shows written before it existed
+    async def ensure_indexes(self):
+        try:
+            await self.shows.update_many(
+                {"title_norm": {"$exists": False}, "title": {"$type": "string"}},
+                [{"$set": {"title_norm": {"$toLower": "$title"}}}],
+            )
+            await self._prepare()
+        except (PyMongoError, TitlesNotUniqueError) as e:
+            logger.error("Could not create indexes on the shows collection: %s", e)
+
+    # Create the indexes of the list before its first write in this worker. The unique title
+    # index must exist before any show is written, so while stored shows share a title the
+    # writes are refused with TitlesNotUniqueError, and only try again every few seconds.
+    async def _prepare(self):
+        if self.list_id in self.prepared:
+            return
+        failed = self.unprepared.get(self.list_id)
+        if failed and time.monotonic() - failed[0] < PREPARE_RETRY_SECONDS:
+            raise TitlesNotUniqueError(failed[1])
+        try:
+            await self.shows.create_indexes(SHOW_INDEXES)
+        except OperationFailure as e:
+            if e.code != 11000:
+                raise
+            detail = f"Shows of list {self.list_id} share a title, rename or delete them to write to it: {(e.details or {}).get('errmsg', e)}"
+            self.unprepared[self.list_id] = (time.monotonic(), detail)
+            raise TitlesNotUniqueError(detail) from e
+        await self.tombstones.create_indexes(TOMBSTONE_INDEXES)
+        self.unprepared.pop(self.list_id, None)
+        self.prepared.add(self.list_id)
+
+    # Build the statistics of shows written before they existed
+    async def ensure_stats(self):
+        try:
+            if await self.show_stats.estimated_document_count() == 0 and await self.shows.estimated_document_count() > 0:
+                await self.rebuild_stats()
+        except PyMongoError as e:
+            logger.error("Could not build the show statistics: %s", e)
+
+    # Add shows to the statistics of their status and take others away, with one upsert per status.
+    # The shows and the statistics are written separately, so a crash in between leaves them
+    # apart until the statistics are rebuilt.
+    async def _count(self, added=(), removed=()):
+        totals = {}
+        for sign, shows in ((1, added), (-1, removed)):
+            for show in shows:
+                key = column_value(show.get("status"))
+                count, episodes = totals.get(key, (0, 0))
+                totals[key] = (count + sign, episodes + sign * episode_count(show.get("current_episode")))
+        operations = [
+            UpdateOne({"_id": key}, {"$inc": {"count": count, "episodes": episodes}}, upsert=True)
+            for key, (count, episodes) in totals.items()
+            if count or episodes
+        ]
+        if operations:
+            await self.show_stats.bulk_write(operations, ordered=False)
+
+    async def load_version(self):
+        meta = await self.db.meta.find_one({"_id": self._name("shows")}, {"epoch": 1, "version": 1})
+        if meta is None or "epoch" not in meta:
+            return None, 0
+        return meta["epoch"], meta["version"]
+
+    # Two workers creating the counter at once may race on the upsert, the loser retries
+    async def allocate_version(self):
+        for attempt in range(2):
+            try:
+                meta = await self.db.meta.find_one_and_update(
+                    {"_id": self._name("shows")},
+                    {"$inc": {"version": 1}, "$setOnInsert": {"epoch": str(ObjectId())}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+                break
+            except DuplicateKeyError:
+                if attempt:
+                    raise
+        return meta["epoch"], meta["version"]
+
+    async def commit_version(self):
+        await self.db.meta.update_one({"_id": self._name("shows")}, {"$inc": {"version": 1}})
+
+    # The reset revision is set first, so exports reading the list meanwhile see it change
+    async def clear(self, rev=0):
+        await self.db.meta.update_one({"_id": self._name("shows")}, {"$set": {"reset_rev": rev}})
+        await self.shows.delete_many({})
+        await self.show_stats.delete_many({})
+        await self.tombstones.delete_many({})
+        self.unprepared.pop(self.list_id, None)
+
+    async def load_reset_rev(self):
+        meta = await self.db.meta.find_one({"_id": self._name("shows")}, {"reset_rev": 1})
+        return (meta or {}).get("reset_rev", 0)
+
+    async def create(self, show, rev):
+        await self._prepare()
+        document = {**show, "title_norm": normalize_title(show["title"]), "rev": rev}
+        try:
+            result = await self.shows.insert_one(document)
+        except DuplicateKeyError:
+            raise DuplicateTitleError(show["title"])
+        await self._count(added=[document])
+        document.pop("title_norm")
+        document["id"] = str(document.pop("_id", result.inserted_id))
+        return document
+
+    async def get(self, show_id):
+        document = await self.shows.find_one({"_id": ObjectId(show_id)}, READ_FIELDS)
+        return to_show(document) if document else None
+
+    # One $in query for all the ids
+    async def get_many(self, show_ids):
+        object_ids = list({ObjectId(show_id) for show_id in show_ids})
+        if not object_ids:
+            return {}
+        found = {}
+        async for document in self.shows.find({"_id": {"$in": object_ids}}, READ_FIELDS):
+            show = to_show(document)
+            found[show["id"]] = show
+        return found
+
+    async def list_shows(self, status=None, sort=None, order="asc", after=None, skip=0, limit=10, projected=False):
+        query = {}
+        if status is not None:
+            query["status"] = status
+        if after:
+            query = {"$and": [query, after_cursor(after, sort, order)]} if query else after_cursor(after, sort, order)
+
+        projection = SHOW_PROJECTION if projected else READ_FIELDS
+        shows = await self.shows.find(query, projection).sort(list_sort(sort, order)).skip(skip).limit(limit).to_list(limit)
+        if not projected:
+            for show in shows:
+                to_show(show)
+        return shows
+
+    # The show before the update is returned, to take it out of the statistics
+    async def update(self, show_id, fields, rev):
+        await self._prepare()
+        try:
+            before = await self.shows.find_one_and_update(
+                {"_id": ObjectId(show_id)},
+                {"$set": {**fields, "title_norm": normalize_title(fields["title"]), "rev": rev}},
+                projection=READ_FIELDS,
+                return_document=ReturnDocument.BEFORE,
+            )
+        except DuplicateKeyError:
+            raise DuplicateTitleError(fields["title"])
+        if not before:
+            return None
+        show = {**before, **fields, "rev": rev}
+        await self._count(added=[show], removed=[before])
+        return to_show(show)
+
+    # One update pipeline, so the new episode is computed from the stored one by the server
+    async def advance_episode(self, show_id, increment, at_least, rev, updated_at):
+        episode = {"$add": [{"$ifNull": ["$current_episode", 0]}, increment]}
+        if at_least is not None:
+            episode = {"$max": [episode, at_least]}
+        before = await self.shows.find_one_and_update(
+            {"_id": ObjectId(show_id)},
+            [{"$set": {"current_episode": episode, "rev": rev, "updated_at": updated_at}}],
+            projection=READ_FIELDS,
+            return_document=ReturnDocument.BEFORE,
+        )
+        if not before:
+            return None
+        episode = advanced_episode(before.get("current_episode"), increment, at_least)
+        show = {**before, "current_episode": episode, "rev": rev, "updated_at": updated_at}
+        await self._count(added=[show], removed=[before])
+        return to_show(show)
+
+    async def delete(self, show_id, rev):
+        await self._prepare()
+        document = await self.shows.find_one_and_delete({"_id": ObjectId(show_id)}, projection=READ_FIELDS)
+        if not document:
+            return None
+        await self._count(removed=[document])
+        await self.tombstones.replace_one({"_id": document["_id"]}, {"rev": rev, "deleted_at": timestamp()}, upsert=True)
+        return to_show(document)
+
+    # One unordered bulk write, with the ids generated up front so results map back to shows
+    async def create_many(self, shows, rev):
+        documents = [
+            {"_id": ObjectId(), **show, "title_norm": normalize_title(show["title"]), "rev": rev}
+            for show in shows
+        ]
+        errors = {}
+        if documents:
+            await self._prepare()
+            try:
+                await self.shows.bulk_write([InsertOne(document) for document in documents], ordered=False)
+            except BulkWriteError as e:
+                errors = {error["index"]: bulk_write_error(error) for error in e.details["writeErrors"]}
+
+        created = {}
+        for index, document in enumerate(documents):
+            if index not in errors:
+                document.pop("title_norm")
+                created[index] = to_show(document)
+        await self._count(added=created.values())
+        return created, errors
+
+    # The shows are read first, with one $in query, to move them between statuses in the statistics
+    async def update_many(self, updates, rev):
+        operations = [
+            UpdateOne({"_id": ObjectId(show_id)}, {"$set": {**fields, "title_norm": normalize_title(fields["title"]), "rev": rev}})
+            for show_id, fields in updates
+        ]
+        if not operations:
+            return {}
+        await self._prepare()
+        object_ids = list({ObjectId(show_id) for show_id, fields in updates})
+        before = {document["_id"]: document async for document in self.shows.find({"_id": {"$in": object_ids}}, STATS_FIELDS)}
+        errors = {}
+        try:
+            await self.shows.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            errors = {error["index"]: bulk_write_error(error) for error in e.details["writeErrors"]}
+
+        added, removed = [], []
+        for index, (show_id, fields) in enumerate(updates):
+            document = before.get(ObjectId(show_id))
+            if index not in errors and document is not None:
+                removed.append(dict(document))
+                document.update(fields)
+                added.append(document)
+        await self._count(added=added, removed=removed)
+        return errors
+
+    async def delete_many(self, show_ids, rev):
+        object_ids = [ObjectId(show_id) for show_id in show_ids]
+        if not object_ids:
+            return
+        await self._prepare()
+        removed = await self.shows.find({"_id": {"$in": object_ids}}, STATS_FIELDS).to_list(None)
+        await self.shows.delete_many({"_id": {"$in": object_ids}})
+        await self._count(removed=removed)
+        deleted_at = timestamp()
+        await self.tombstones.bulk_write(
+            [ReplaceOne({"_id": object_id}, {"rev": rev, "deleted_at": deleted_at}, upsert=True) for object_id in object_ids],
+            ordered=False,
+        )
+
+    # Imports are written to a collection of their own. Only the unique title index is built
+    # up front, to reject duplicate titles as they are written; the others are built once.
+    async def stage_import(self):
+        staging = self.db[f"shows_import_{ObjectId()}"]
+        await staging.create_indexes([TITLE_UNIQUE_INDEX])
+        return staging.name
+
+    # One ReplaceOne upsert per show, sent as a single unordered bulk write
+    async def import_batch(self, shows, staging):
+        operations = []
+        for show in shows:
+            show["_id"] = ObjectId(show["id"])
+            show["rev"] = 0
+            if isinstance(show.get("title"), str):
+                show["title_norm"] = normalize_title(show["title"])
+            operations.append(ReplaceOne({"_id": show["_id"]}, show, upsert=True))
+
+        try:
+            result = await self.db[staging].bulk_write(operations, ordered=False)
+            return {"inserted": result.upserted_count, "updated": result.matched_count}, []
+        except BulkWriteError as e:
+            errors = [
+                (error["index"], DUPLICATE_TITLE if error["code"] == 11000 else error["errmsg"])
+                for error in e.details["writeErrors"]
+            ]
+            return {"inserted": e.details["nUpserted"], "updated": e.details["nMatched"]}, errors
+
+    # renameCollection replaces the list's shows collection atomically, indexes included.
+    # The reset revision is set before, like clear does. The statistics of the staged shows are
+    # computed up front and swapped in by the very next command, so only a write landing between
+    # the two is left out of them until the next rebuild.
+    # An import also repairs a list whose stored shows shared a title.
+    async def commit_import(self, staging, rev):
+        await self.db[staging].update_many({}, {"$set": {"rev": rev}})
+        await self.db[staging].create_indexes(SHOW_INDEXES)
+        stats = await self._aggregate_stats(self.db[staging])
+        await self.db.meta.update_one({"_id": self._name("shows")}, {"$set": {"reset_rev": rev}})
+        await self.db[staging].rename(self._name("shows"), dropTarget=True)
+        await self._replace_stats(stats)
+        self.unprepared.pop(self.list_id, None)
+        await self._prepare()
+        await self.tombstones.delete_many({})
+
+    async def discard_import(self, staging):
+        await self.db.drop_collection(staging)
+
+    # Documents of a query in the given index order, one query per batch, so that an import
+    # renaming its collection over the list cannot kill a cursor midway. Standalone servers have
+    # no snapshot reads, so the reset revision is read again after each batch instead: once the
+    # list was cleared or imported over, the export fails rather than mix the old and new shows.
+    async def _read_batches(self, collection, query, projection, sort, batch_size, reset_rev):
+        condition = query
+        while True:
+            documents = await collection.find(condition, projection).sort(sort).limit(batch_size).to_list(batch_size)
+            if await self.load_reset_rev() != reset_rev:
+                raise ListReplacedError(self.list_id)
+            for document in documents:
+                yield document
+            if len(documents) < batch_size:
+                return
+            # The next batch starts after the last document, on every field of the sort
+            last = documents[-1]
+            after = {"_id": {"$gt": last["_id"]}}
+            for field, _ in reversed(sort[:-1]):
+                after = {"$or": [{field: {"$gt": last[field]}}, {field: last[field], **after}]}
+            condition = {"$and": [query, after]}
+
+    # Shows in _id order, one batch in memory at a time.
+    # Unprojected shows keep every stored field so exports stay byte compatible with earlier ones.
+    async def iter_shows(self, projected=False, batch_size=1000):
+        reset_rev = await self.load_reset_rev()
+        projection = SHOW_FIELDS_PROJECTION if projected else INTERNAL_FIELDS
+        async for document in self._read_batches(self.shows, {}, projection, [("_id", ASCENDING)], batch_size, reset_rev):
+            yield project_show(str(document["_id"]), document) if projected else to_show(document)
+
+    # Both queries walk a rev index from the first revision after since
+    async def iter_changes(self, since, batch_size=1000):
+        reset_rev = await self.load_reset_rev()
+        if since < reset_rev:
+            raise ListReplacedError(self.list_id)
+        order = [("rev", ASCENDING), ("_id", ASCENDING)]
+        async for document in self._read_batches(self.shows, {"rev": {"$gt": since}}, READ_FIELDS, order, batch_size, reset_rev):
+            yield to_show(document)
+        async for document in self._read_batches(self.tombstones, {"rev": {"$gt": since}}, None, order, batch_size, reset_rev):
+            yield tombstone(str(document["_id"]), document["rev"], document["deleted_at"])
+
+    # Titles starting with the query use a tight range of the title_norm index,
+    # titles only containing it are matched on index keys alone.
+    # An anchored regex is a range scan of the title_norm index.
+    async def search(self, query, limit):
+        cursor = self.shows.find({"title_norm": {"$regex": "^" + re.escape(query)}}, READ_FIELDS)
+        return [to_show(show) async for show in cursor.sort("title_norm", ASCENDING).limit(limit)]
+
+    # The projection is served from the title_norm index without reading any show.
+    async def suggest(self, query, limit):
+        cursor = self.shows.find({"title_norm": {"$regex": "^" + re.escape(query)}}, {"_id": 0, "title": 1})
+        return [show["title"] async for show in cursor.sort("title_norm", ASCENDING).limit(limit)]
+
+    async def load_stats(self):
+        cursor = self.show_stats.find({"count": {"$gt": 0}})
+        return [{"status": document["_id"], "count": document["count"], "episodes": document["episodes"]} async for document in cursor]
+
+    async def compute_stats(self):
+        return await self._aggregate_stats(self.shows)
+
+    async def rebuild_stats(self):
+        stats = await self.compute_stats()
+        await self._replace_stats(stats)
+        return stats
+
+    # Statistics of a collection of shows, computed by the aggregation pipeline
+    async def _aggregate_stats(self, collection):
+        totals = {}
+        async for group in collection.aggregate(STATS_PIPELINE):
+            key = column_value(group["_id"])
+            count, episodes = totals.get(key, (0, 0))
+            totals[key] = (count + group["count"], episodes + group["episodes"])
+        return [{"status": key, "count": count, "episodes": episodes} for key, (count, episodes) in totals.items()]
+
+    # Replace the statistics in one ordered bulk write: each status is overwritten in place
+    # and the statuses left over are deleted after. The statistics are never empty meanwhile,
+    # and an $inc upsert of a concurrent write cannot make the replacement fail or survive it
+    # in a status that no longer exists.
+    async def _replace_stats(self, stats):
+        operations = [
+            ReplaceOne({"_id": row["status"]}, {"count": row["count"], "episodes": row["episodes"]}, upsert=True)
+            for row in stats
+        ]
+        operations.append(DeleteMany({"_id": {"$nin": [row["status"] for row in stats]}}))
+        await self.show_stats.bulk_write(operations, ordered=True)
+
+    # Feed the brokers from a change stream on the database, so writes made by other workers
+    # are seen too. Each change goes to the broker of the list whose collection it touched; an
+    # import renaming its staging collection over a list resets that list. Standalone servers
+    # have no change streams, in which case the write endpoints feed the brokers instead.
+    async def watch(self, brokers):
+        pipeline = [{"$match": {"$or": [{"ns.coll": LIST_COLLECTION_FILTER}, {"to.coll": LIST_COLLECTION_FILTER}]}}]
+        resume_token = None
+        while True:
+            try:
+                async with self.db.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                    brokers.external_feed = True
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        operation = change["operationType"]
+                        if operation == "invalidate":
+                            brokers.publish_all("reset", {})
+                            resume_token = None
+                            continue
+                        list_id = collection_list(change["ns"].get("coll", ""))
+                        if operation == "rename":
+                            list_id = collection_list(change["to"]["coll"]) or list_id
+                        if list_id is None:
+                            continue
+                        if operation in ("insert", "update", "replace") and change.get("fullDocument"):
+                            event_type = "create" if operation == "insert" else "update"
+                            brokers.publish(list_id, event_type, show_event_data(change["fullDocument"]))
+                        elif operation == "delete":
+                            brokers.publish(list_id, "delete", {"id": str(change["documentKey"]["_id"])})
+                        elif operation in ("drop", "rename"):
+                            brokers.publish(list_id, "reset", {})
+            except OperationFailure as e:
+                brokers.external_feed = False
+                raise ChangeStreamUnavailable(str(e))
+            except PyMongoError as e:
+                brokers.external_feed = False
+                logger.warning("Change stream interrupted, reconnecting: %s", e)
+                await asyncio.sleep(1)
+
+    def pool_stats(self):
+        return {"backend": self.name, **self.stats.snapshot()}
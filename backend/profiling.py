@@ -0,0 +1,153 @@
+import contextvars
+import cProfile
+import hmac
+import inspect
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from bson import ObjectId
+
+# Profile of the request being handled, if it is profiled
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+# Storage wrapper that times every call the profiled request awaits, including each batch of a streamed read
+class TimedRepository:
+    def __init__(self, repository, profile):
+        self._repository = repository
+        self._profile = profile
+
+    def __getattr__(self, name):
+        attribute = getattr(self._repository, name)
+        if inspect.iscoroutinefunction(attribute):
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await attribute(*args, **kwargs)
+                finally:
+                    self._profile.record_storage(name, time.perf_counter() - start)
+            return timed
+        if inspect.isasyncgenfunction(attribute):
+            async def timed_iteration(*args, **kwargs):
+                iterator = attribute(*args, **kwargs)
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        self._profile.record_storage(name, time.perf_counter() - start)
+                    yield item
+            return timed_iteration
+        return attribute
+
+
+# One profiled request. cProfile records the calls made on the event loop thread with a wall
+# clock timer; the storage calls the request awaited are timed separately, since the time a
+# coroutine spends suspended on the database does not show in a Python profile.
+class RequestProfile:
+    def __init__(self, method, path, trigger):
+        self.id = str(ObjectId())
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.status_code = None
+        self.storage = {}
+        self.profiler = cProfile.Profile(time.perf_counter)
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", path).strip("-") or "root"
+        self.name = f"{time.strftime('%Y%m%d-%H%M%S')}-{method}-{slug[:60]}-{self.id}"
+
+    def record_storage(self, operation, seconds):
+        calls, total = self.storage.get(operation, (0, 0.0))
+        self.storage[operation] = (calls + 1, total + seconds)
+
+    def wrap(self, repository):
+        return TimedRepository(repository, self)
+
+    def start(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        self.wall_seconds = time.perf_counter() - self.wall_start
+        # Thread CPU time, which includes other requests the event loop ran in the meantime.
+        self.cpu_seconds = time.thread_time() - self.cpu_start
+
+    # Save the cProfile stats (for pstats or snakeviz) and a JSON summary next to them
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.name)
+        self.profiler.dump_stats(base + ".prof")
+        summary = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status_code,
+            "trigger": self.trigger,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "storage_seconds": round(sum(total for calls, total in self.storage.values()), 6),
+            "storage": {
+                operation: {"calls": calls, "seconds": round(total, 6)}
+                for operation, (calls, total) in sorted(self.storage.items())
+            },
+        }
+        with open(base + ".json", "w") as f:
+            json.dump(summary, f, indent=4)
+        return base
+
+
+# ASGI middleware profiling the requests that carry the profiling header with the right token,
+# and a random sample of the others. Only one request is profiled at a time, since a profiler
+# sees every coroutine running on the thread; requests arriving meanwhile run unprofiled.
+# Profiled responses carry an X-Profile-Id header naming the saved files.
+class ProfilingMiddleware:
+    def __init__(self, app, directory, token=None, sample_rate=0.0, header="x-profile"):
+        self.app = app
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.header = header.lower().encode("latin-1")
+        self.lock = threading.Lock()
+
+    def trigger(self, scope):
+        if self.token:
+            for name, value in scope["headers"]:
+                if name == self.header and hmac.compare_digest(value, self.token.encode("latin-1")):
+                    return "header"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        trigger = self.trigger(scope) if scope["type"] == "http" else None
+        if trigger is None or not self.lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], trigger)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.name.encode("latin-1"))]
+            await send(message)
+
+        context = current_profile.set(profile)
+        try:
+            profile.start()
+            try:
+                await self.app(scope, receive, send_with_profile_id)
+            finally:
+                profile.stop()
+                profile.save(self.directory)
+        finally:
+            current_profile.reset(context)
+            self.lock.release()
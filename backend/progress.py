@@ -0,0 +1,92 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Combine two progress updates, each an (increment, at_least) pair, into one with the same
+# effect as applying the first and then the second:
+# max(max(e + i1, m1) + i2, m2) = max(e + i1 + i2, m1 + i2, m2)
+def compose_progress(first, second):
+    increment = first[0] + second[0]
+    at_least = first[1] + second[0] if first[1] is not None else None
+    if second[1] is not None:
+        at_least = second[1] if at_least is None else max(at_least, second[1])
+    return increment, at_least
+
+
+# Write-behind buffer of episode progress updates, keyed by the (list_id, show_id) of their show.
+# Updates of the same show arriving within one interval are merged into a single update,
+# and the buffer is flushed every interval seconds and once more on shutdown. Updates a
+# flush could not write are put back for the next one. Buffered updates are lost if the
+# process dies before a flush.
+class ProgressBuffer:
+    def __init__(self, interval=0.0):
+        self.interval = interval
+        self.pending = {}
+        self.received = 0
+        self.flushes = 0
+        self.restored = 0
+        # Flush started by run(), which stop() waits for
+        self.flushing = None
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def add(self, key, increment, at_least):
+        self.received += 1
+        if key in self.pending:
+            self.pending[key] = compose_progress(self.pending[key], (increment, at_least))
+        else:
+            self.pending[key] = (increment, at_least)
+
+    # The pending updates by key, leaving the buffer empty
+    def take(self):
+        pending, self.pending = self.pending, {}
+        if pending:
+            self.flushes += 1
+        return pending
+
+    # Put back updates a flush could not write, merged before those received since
+    def restore(self, updates):
+        for key, update in updates.items():
+            self.restored += 1
+            if key in self.pending:
+                self.pending[key] = compose_progress(update, self.pending[key])
+            else:
+                self.pending[key] = update
+
+    # Call flush() every interval until cancelled. Cancelling does not interrupt a flush in
+    # progress, which could not tell the updates it wrote from the others.
+    async def run(self, flush):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.flushing = asyncio.ensure_future(self._flush(flush))
+            await asyncio.shield(self.flushing)
+
+    async def _flush(self, flush):
+        try:
+            await flush()
+        except Exception as e:
+            logger.error("Could not write buffered progress updates: %s", e)
+
+    # Cancel a task running run() and wait for the flush it may be in the middle of
+    async def stop(self, runner):
+        runner.cancel()
+        try:
+            await runner
+        except asyncio.CancelledError:
+            pass
+        if self.flushing is not None:
+            await self.flushing
+
+    def snapshot(self):
+        return {
+            "enabled": self.enabled,
+            "interval_seconds": self.interval,
+            "pending": len(self.pending),
+            "received": self.received,
+            "flushes": self.flushes,
+            "restored": self.restored,
+        }
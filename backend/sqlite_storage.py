@@ -0,0 +1,613 @@
+import asyncio
+import copy
+import json
+import sqlite3
+from contextlib import asynccontextmanager
+
+import aiosqlite
+from bson import ObjectId
+
+from storage import DEFAULT_LIST, DUPLICATE_TITLE, DuplicateTitleError, ListReplacedError, SORT_FIELDS, ShowRepository, advanced_episode, column_value, normalize_title, project_show, timestamp, tombstone
+
+# The whole show is kept as JSON in doc, so imported fields survive a round trip.
+# The other columns copy the fields queries filter and sort on, and have no declared
+# type so values are compared like Mongo does: missing first, then numbers, then strings.
+# Every list has its own shows in the one table. Ids and titles are unique within a list,
+# and every index leads with list_id, so a query only ever reads the rows of its list.
+SHOWS_COLUMNS = """
+    list_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    title,
+    title_norm,
+    status,
+    current_episode,
+    rev INTEGER NOT NULL DEFAULT 0,
+    doc TEXT NOT NULL,
+    PRIMARY KEY (list_id, id),
+    UNIQUE (list_id, title)
+"""
+
+TOMBSTONES_COLUMNS = """
+    list_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    rev INTEGER NOT NULL,
+    deleted_at TEXT NOT NULL,
+    PRIMARY KEY (list_id, id)
+"""
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS shows ({SHOWS_COLUMNS});
+CREATE INDEX IF NOT EXISTS title_id ON shows (list_id, title, id);
+CREATE INDEX IF NOT EXISTS status_id ON shows (list_id, status, id);
+CREATE INDEX IF NOT EXISTS status_title_id ON shows (list_id, status, title, id);
+CREATE INDEX IF NOT EXISTS current_episode_id ON shows (list_id, current_episode, id);
+CREATE INDEX IF NOT EXISTS status_current_episode_id ON shows (list_id, status, current_episode, id);
+CREATE INDEX IF NOT EXISTS title_norm_title ON shows (list_id, title_norm, title);
+CREATE INDEX IF NOT EXISTS rev_id ON shows (list_id, rev, id);
+CREATE TABLE IF NOT EXISTS tombstones ({TOMBSTONES_COLUMNS});
+CREATE INDEX IF NOT EXISTS tombstones_rev_id ON tombstones (list_id, rev, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    epoch TEXT NOT NULL
+);
+"""
+
+# Episodes a row adds to the statistics, as episode_count counts them
+def episodes_of(row):
+    return f"CASE WHEN typeof({row}.current_episode) IN ('integer', 'real') THEN {row}.current_episode ELSE 0 END"
+
+
+# Count and episode total of each status of each list, keyed by the status quoted as an SQL
+# literal so a missing status has a key too. Triggers keep it up to date in the transaction
+# of every write.
+STATS_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS stats (
+    list_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    status,
+    count INTEGER NOT NULL,
+    episodes NOT NULL,
+    PRIMARY KEY (list_id, key)
+);
+CREATE TRIGGER IF NOT EXISTS stats_insert AFTER INSERT ON shows BEGIN
+    INSERT INTO stats VALUES (NEW.list_id, quote(NEW.status), NEW.status, 1, {episodes_of("NEW")})
+    ON CONFLICT (list_id, key) DO UPDATE SET count = count + 1, episodes = episodes + excluded.episodes;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_delete AFTER DELETE ON shows BEGIN
+    UPDATE stats SET count = count - 1, episodes = episodes - {episodes_of("OLD")}
+    WHERE list_id = OLD.list_id AND key = quote(OLD.status);
+    DELETE FROM stats WHERE list_id = OLD.list_id AND key = quote(OLD.status) AND count = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_update AFTER UPDATE OF status, current_episode ON shows BEGIN
+    UPDATE stats SET count = count - 1, episodes = episodes - {episodes_of("OLD")}
+    WHERE list_id = OLD.list_id AND key = quote(OLD.status);
+    DELETE FROM stats WHERE list_id = OLD.list_id AND key = quote(OLD.status) AND count = 0;
+    INSERT INTO stats VALUES (NEW.list_id, quote(NEW.status), NEW.status, 1, {episodes_of("NEW")})
+    ON CONFLICT (list_id, key) DO UPDATE SET count = count + 1, episodes = episodes + excluded.episodes;
+END;
+"""
+
+# Statistics of one list recomputed from its shows, and of all lists for a database written
+# before the statistics existed
+REBUILD_STATS = (
+    "DELETE FROM stats WHERE list_id = ?",
+    f"INSERT INTO stats SELECT list_id, quote(status), status, count(*), sum({episodes_of('shows')}) FROM shows WHERE list_id = ? GROUP BY quote(status)",
+)
+COMPUTE_STATS = f"SELECT status, count(*), sum({episodes_of('shows')}) FROM shows WHERE list_id = ? GROUP BY quote(status)"
+REBUILD_ALL_STATS = (
+    "DELETE FROM stats",
+    f"INSERT INTO stats SELECT list_id, quote(status), status, count(*), sum({episodes_of('shows')}) FROM shows GROUP BY list_id, quote(status)",
+)
+
+# A database written before shows were kept in lists has its tables rebuilt once, in one
+# transaction, with every show in the default list. The statistics are rebuilt after.
+MIGRATE_TO_LISTS = (
+    "DROP TRIGGER IF EXISTS stats_insert",
+    "DROP TRIGGER IF EXISTS stats_delete",
+    "DROP TRIGGER IF EXISTS stats_update",
+    "DROP TABLE IF EXISTS stats",
+    "ALTER TABLE shows RENAME TO unlisted_shows",
+    "ALTER TABLE tombstones RENAME TO unlisted_tombstones",
+    f"CREATE TABLE shows ({SHOWS_COLUMNS})",
+    f"CREATE TABLE tombstones ({TOMBSTONES_COLUMNS})",
+    f"INSERT INTO shows SELECT '{DEFAULT_LIST}', * FROM unlisted_shows",
+    f"INSERT INTO tombstones SELECT '{DEFAULT_LIST}', * FROM unlisted_tombstones",
+    "DROP TABLE unlisted_shows",
+    "DROP TABLE unlisted_tombstones",
+    f"UPDATE meta SET key = key || ':{DEFAULT_LIST}' WHERE key IN ('shows', 'reset')",
+)
+
+# The version of a list is kept in meta under "shows:<list_id>", its reset revision as the
+# version of the row "reset:<list_id>".
+SET_RESET_REV = "INSERT OR REPLACE INTO meta (key, version, epoch) VALUES (?, ?, '')"
+
+# Insert a show into a table of shows or replace the one with the same id in its list. Unlike
+# INSERT OR REPLACE, a clash with another show's title fails instead of deleting that show.
+UPSERT = """
+INSERT INTO {table} VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (list_id, id) DO UPDATE SET
+    title = excluded.title,
+    title_norm = excluded.title_norm,
+    status = excluded.status,
+    current_episode = excluded.current_episode,
+    rev = excluded.rev,
+    doc = excluded.doc
+"""
+
+
+# Column values of a show, in the order of the shows table
+def show_row(list_id, show_id, show, rev):
+    title = show.get("title")
+    return (
+        list_id,
+        show_id,
+        column_value(title),
+        normalize_title(title) if isinstance(title, str) else None,
+        column_value(show.get("status")),
+        column_value(show.get("current_episode")),
+        rev,
+        json.dumps(show),
+    )
+
+
+def read_row(row):
+    show_id, rev, doc = row
+    show = json.loads(doc)
+    show["rev"] = rev
+    show["id"] = show_id
+    return show
+
+
+# Condition selecting the rows after a cursor position. SQL comparisons with NULL are never
+# true, so a missing sort value, which sorts first, needs conditions of its own.
+def after_condition(position, sort, order):
+    less = order == "desc"
+    after = "<" if less else ">"
+    if not sort:
+        return f"id {after} ?", [position["id"]]
+    key = column_value(position.get("key"))
+    if key is None:
+        if less:
+            return f"({sort} IS NULL AND id < ?)", [position["id"]]
+        return f"({sort} IS NOT NULL OR id > ?)", [position["id"]]
+    condition = f"({sort} {after} ? OR ({sort} = ? AND id {after} ?)"
+    if less:
+        condition += f" OR {sort} IS NULL"
+    return condition + ")", [key, key, position["id"]]
+
+
+# Values accepted by PRAGMA synchronous. NORMAL is durable against crashes of the process in WAL
+# mode, only a power loss can undo the last transactions.
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+# Upper bound of the strings starting with a prefix, for an index range scan
+def prefix_end(prefix):
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+# Shows stored in a single SQLite file, for single node deployments without a Mongo server.
+# The database runs in WAL mode, where readers do not block the writer nor each other, so
+# the repository keeps one connection for writes and a pool of read-only connections.
+# aiosqlite runs each connection on a thread of its own; writes take turns on the writer,
+# reads go to the reader with the fewest queries in flight. The repositories of other lists
+# are shallow copies sharing the connections, so writes to any list take turns too.
+class SQLiteShowRepository(ShowRepository):
+    name = "sqlite"
+
+    def __init__(self, path, readers=4, cache_size_kb=65536, mmap_size=268435456, synchronous="NORMAL", busy_timeout_ms=5000):
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Unknown synchronous mode: {synchronous}")
+        self.path = path
+        self.reader_count = max(readers, 1)
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.synchronous = synchronous.upper()
+        self.busy_timeout_ms = busy_timeout_ms
+        self.writer = None
+        self.readers = []
+        self.reader_queries = []
+        self.write_lock = None
+
+    async def _connect(self, read_only):
+        connection = await aiosqlite.connect(self.path, isolation_level=None)
+        # A negative cache_size is in KiB rather than pages.
+        await connection.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        await connection.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        await connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        await connection.execute("PRAGMA temp_store = MEMORY")
+        if read_only:
+            await connection.execute("PRAGMA query_only = ON")
+        else:
+            await connection.execute(f"PRAGMA synchronous = {self.synchronous}")
+        return connection
+
+    async def start(self):
+        if self.writer is not None:
+            return
+        writer = await self._connect(read_only=False)
+        # WAL is a property of the file, kept once set. Readers must only connect after it is.
+        await writer.execute("PRAGMA journal_mode = WAL")
+        columns = await writer.execute_fetchall("SELECT name FROM pragma_table_info('shows')")
+        if columns and ("list_id",) not in columns:
+            await writer.execute("BEGIN IMMEDIATE")
+            try:
+                for statement in MIGRATE_TO_LISTS:
+                    await writer.execute(statement)
+            except BaseException:
+                await writer.execute("ROLLBACK")
+                raise
+            await writer.execute("COMMIT")
+        await writer.executescript(SCHEMA)
+        await writer.executescript(STATS_SCHEMA)
+        # A database written before the statistics existed has them built once.
+        rows = await writer.execute_fetchall("SELECT EXISTS (SELECT 1 FROM stats), EXISTS (SELECT 1 FROM shows)")
+        if rows[0] == (0, 1):
+            for statement in REBUILD_ALL_STATS:
+                await writer.execute(statement)
+        self.readers = [await self._connect(read_only=True) for _ in range(self.reader_count)]
+        self.reader_queries = [0] * self.reader_count
+        self.write_lock = asyncio.Lock()
+        self.writer = writer
+
+    async def close(self):
+        if self.writer is None:
+            return
+        writer, readers = self.writer, self.readers
+        self.writer, self.readers, self.reader_queries = None, [], []
+        for reader in readers:
+            await reader.close()
+        # Let SQLite refresh the statistics of the tables the workers queried.
+        await writer.execute("PRAGMA optimize")
+        await writer.close()
+
+    def for_list(self, list_id):
+        repository = copy.copy(self)
+        repository.list_id = list_id
+        return repository
+
+    def pool_stats(self):
+        return {
+            "backend": self.name,
+            "readers": len(self.readers),
+            "reads_in_flight": sum(self.reader_queries),
+            "write_locked": bool(self.write_lock and self.write_lock.locked()),
+        }
+
+    # The least busy reader, for a read outside of a transaction
+    @asynccontextmanager
+    async def _reading(self):
+        index = min(range(len(self.readers)), key=self.reader_queries.__getitem__)
+        self.reader_queries[index] += 1
+        try:
+            yield self.readers[index]
+        finally:
+            self.reader_queries[index] -= 1
+
+    # A read-only connection of its own in one read transaction, for reads made of many queries
+    # that must see the database at a single moment, such as exports. It is opened for the
+    # occasion so a long export does not hold one of the pooled readers.
+    @asynccontextmanager
+    async def _snapshot(self):
+        connection = await self._connect(read_only=True)
+        try:
+            await connection.execute("BEGIN")
+            yield connection
+        finally:
+            await connection.close()
+
+    # The writer, in a transaction nothing else writes during. Every write goes through here,
+    # a statement run on the writer outside of it would join another request's transaction.
+    @asynccontextmanager
+    async def _writing(self):
+        async with self.write_lock:
+            await self.writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.writer
+            except BaseException:
+                await self.writer.execute("ROLLBACK")
+                raise
+            await self.writer.execute("COMMIT")
+
+    async def _version(self, connection):
+        rows = await connection.execute_fetchall("SELECT epoch, version FROM meta WHERE key = ?", (f"shows:{self.list_id}",))
+        return tuple(rows[0]) if rows else None
+
+    async def load_version(self):
+        async with self._reading() as connection:
+            return await self._version(connection) or (None, 0)
+
+    async def allocate_version(self):
+        async with self._writing() as connection:
+            await connection.execute(
+                "INSERT OR IGNORE INTO meta (key, version, epoch) VALUES (?, 0, ?)", (f"shows:{self.list_id}", str(ObjectId()))
+            )
+            await connection.execute("UPDATE meta SET version = version + 1 WHERE key = ?", (f"shows:{self.list_id}",))
+            return await self._version(connection)
+
+    async def commit_version(self):
+        async with self._writing() as connection:
+            await connection.execute("UPDATE meta SET version = version + 1 WHERE key = ?", (f"shows:{self.list_id}",))
+
+    async def clear(self, rev=0):
+        async with self._writing() as connection:
+            await connection.execute("DELETE FROM shows WHERE list_id = ?", (self.list_id,))
+            await connection.execute("DELETE FROM tombstones WHERE list_id = ?", (self.list_id,))
+            await connection.execute(SET_RESET_REV, (f"reset:{self.list_id}", rev))
+
+    async def load_reset_rev(self):
+        async with self._reading() as connection:
+            rows = await connection.execute_fetchall("SELECT version FROM meta WHERE key = ?", (f"reset:{self.list_id}",))
+        return rows[0][0] if rows else 0
+
+    async def _select(self, connection, show_id):
+        rows = await connection.execute_fetchall(
+            "SELECT id, rev, doc FROM shows WHERE list_id = ? AND id = ?", (self.list_id, show_id)
+        )
+        return read_row(rows[0]) if rows else None
+
+    async def _insert(self, connection, show, rev):
+        show_id = str(ObjectId())
+        try:
+            await connection.execute("INSERT INTO shows VALUES (?, ?, ?, ?, ?, ?, ?, ?)", show_row(self.list_id, show_id, show, rev))
+        except sqlite3.IntegrityError:
+            raise DuplicateTitleError(show["title"])
+        return {**show, "rev": rev, "id": show_id}
+
+    async def _update(self, connection, show_id, fields, rev):
+        show = await self._select(connection, show_id)
+        if show is None:
+            return None
+        del show["id"], show["rev"]
+        show.update(fields)
+        try:
+            await connection.execute(
+                "UPDATE shows SET title = ?, title_norm = ?, status = ?, current_episode = ?, rev = ?, doc = ? WHERE list_id = ? AND id = ?",
+                show_row(self.list_id, show_id, show, rev)[2:] + (self.list_id, show_id),
+            )
+        except sqlite3.IntegrityError:
+            raise DuplicateTitleError(fields["title"])
+        return {**show, "rev": rev, "id": show_id}
+
+    async def create(self, show, rev):
+        async with self._writing() as connection:
+            return await self._insert(connection, show, rev)
+
+    async def get(self, show_id):
+        async with self._reading() as connection:
+            return await self._select(connection, show_id)
+
+    async def get_many(self, show_ids):
+        show_ids_list = list(set(show_ids))
+        found = {}
+        async with self._reading() as connection:
+            # Stay under SQLite's limit on bound parameters.
+            for start in range(0, len(show_ids_list), 500):
+                chunk = show_ids_list[start:start + 500]
+                rows = await connection.execute_fetchall(
+                    f"SELECT id, rev, doc FROM shows WHERE list_id = ? AND id IN ({', '.join('?' * len(chunk))})",
+                    [self.list_id] + chunk,
+                )
+                for row in rows:
+                    found[row[0]] = read_row(row)
+        return found
+
+    async def list_shows(self, status=None, sort=None, order="asc", after=None, skip=0, limit=10, projected=False):
+        if sort is not None and sort not in SORT_FIELDS:
+            raise ValueError(f"Cannot sort on {sort}")
+        conditions = ["list_id = ?"]
+        params = [self.list_id]
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(column_value(status))
+        if after:
+            condition, values = after_condition(after, sort, order)
+            conditions.append(condition)
+            params += values
+
+        direction = "DESC" if order == "desc" else "ASC"
+        order_by = f"{sort} {direction}, id {direction}" if sort else f"id {direction}"
+        query = f"SELECT id, rev, doc FROM shows WHERE {' AND '.join(conditions)} ORDER BY {order_by} LIMIT ? OFFSET ?"
+        params += [abs(limit) if limit else -1, max(skip, 0)]
+
+        async with self._reading() as connection:
+            rows = await connection.execute_fetchall(query, params)
+        if projected:
+            return [project_show(show_id, json.loads(doc)) for show_id, rev, doc in rows]
+        return [read_row(row) for row in rows]
+
+    async def update(self, show_id, fields, rev):
+        async with self._writing() as connection:
+            return await self._update(connection, show_id, fields, rev)
+
+    # Read and written in one transaction on the writer, so no other write comes in between
+    async def advance_episode(self, show_id, increment, at_least, rev, updated_at):
+        async with self._writing() as connection:
+            show = await self._select(connection, show_id)
+            if show is None:
+                return None
+            episode = advanced_episode(show.get("current_episode"), increment, at_least)
+            return await self._update(connection, show_id, {"current_episode": episode, "updated_at": updated_at}, rev)
+
+    async def delete(self, show_id, rev):
+        async with self._writing() as connection:
+            show = await self._select(connection, show_id)
+            if show is not None:
+                await connection.execute("DELETE FROM shows WHERE list_id = ? AND id = ?", (self.list_id, show_id))
+                await connection.execute(
+                    "INSERT OR REPLACE INTO tombstones VALUES (?, ?, ?, ?)", (self.list_id, show_id, rev, timestamp())
+                )
+            return show
+
+    # All shows in one transaction. A failed statement only undoes itself, so the others stay.
+    async def create_many(self, shows, rev):
+        created = {}
+        errors = {}
+        async with self._writing() as connection:
+            for index, show in enumerate(shows):
+                try:
+                    created[index] = await self._insert(connection, show, rev)
+                except DuplicateTitleError:
+                    errors[index] = (400, "Show with this title already exists")
+        return created, errors
+
+    async def update_many(self, updates, rev):
+        errors = {}
+        async with self._writing() as connection:
+            for index, (show_id, fields) in enumerate(updates):
+                try:
+                    await self._update(connection, show_id, fields, rev)
+                except DuplicateTitleError:
+                    errors[index] = (400, "Show with this title already exists")
+        return errors
+
+    async def delete_many(self, show_ids, rev):
+        deleted_at = timestamp()
+        async with self._writing() as connection:
+            await connection.executemany(
+                "DELETE FROM shows WHERE list_id = ? AND id = ?", [(self.list_id, show_id) for show_id in show_ids]
+            )
+            await connection.executemany(
+                "INSERT OR REPLACE INTO tombstones VALUES (?, ?, ?, ?)",
+                [(self.list_id, show_id, rev, deleted_at) for show_id in show_ids],
+            )
+
+    # Imports are written to a temporary table of the writer connection, which readers
+    # never see, with the same unique title constraint as the shows table.
+    async def stage_import(self):
+        staging = f"shows_import_{ObjectId()}"
+        async with self._writing() as connection:
+            await connection.execute(f"CREATE TEMP TABLE {staging} ({SHOWS_COLUMNS})")
+        return staging
+
+    # The whole batch is written with one executemany under a savepoint. Only when a title
+    # clashes is it rolled back and written row by row, to reject the clashing rows alone.
+    async def import_batch(self, shows, staging):
+        upsert = UPSERT.format(table=f"temp.{staging}")
+        rows = []
+        for show in shows:
+            show_id = str(ObjectId(show["id"]))
+            rows.append(show_row(self.list_id, show_id, {key: value for key, value in show.items() if key != "id"}, 0))
+        # An id imported twice in the batch is only inserted once.
+        show_ids = list({row[1] for row in rows})
+        counts = {"inserted": 0, "updated": 0}
+        errors = []
+
+        async with self._writing() as connection:
+            existing = set()
+            for start in range(0, len(show_ids), 500):
+                chunk = show_ids[start:start + 500]
+                found = await connection.execute_fetchall(
+                    f"SELECT id FROM temp.{staging} WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                existing.update(show_id for (show_id,) in found)
+
+            await connection.execute("SAVEPOINT import_batch")
+            try:
+                await connection.executemany(upsert, rows)
+                written = rows
+            except sqlite3.IntegrityError:
+                await connection.execute("ROLLBACK TO import_batch")
+                written = []
+                for position, row in enumerate(rows):
+                    try:
+                        await connection.execute(upsert, row)
+                    except sqlite3.IntegrityError:
+                        errors.append((position, DUPLICATE_TITLE))
+                    else:
+                        written.append(row)
+            await connection.execute("RELEASE import_batch")
+
+        for row in written:
+            counts["updated" if row[1] in existing else "inserted"] += 1
+            existing.add(row[1])
+        return counts, errors
+
+    # The shows of the list are replaced in one transaction, stamped with rev as they are copied.
+    # Readers keep reading the old shows from the WAL snapshot they started on until it commits.
+    async def commit_import(self, staging, rev):
+        async with self._writing() as connection:
+            await connection.execute("DELETE FROM shows WHERE list_id = ?", (self.list_id,))
+            await connection.execute(
+                f"INSERT INTO shows SELECT list_id, id, title, title_norm, status, current_episode, ?, doc FROM temp.{staging}", (rev,)
+            )
+            await connection.execute(f"DROP TABLE temp.{staging}")
+            await connection.execute("DELETE FROM tombstones WHERE list_id = ?", (self.list_id,))
+            await connection.execute(SET_RESET_REV, (f"reset:{self.list_id}", rev))
+
+    async def discard_import(self, staging):
+        async with self._writing() as connection:
+            await connection.execute(f"DROP TABLE IF EXISTS temp.{staging}")
+
+    # Shows in id order, one batch per query, all in one snapshot
+    async def iter_shows(self, projected=False, batch_size=1000):
+        last_id = ""
+        async with self._snapshot() as connection:
+            while True:
+                rows = await connection.execute_fetchall(
+                    "SELECT id, doc FROM shows WHERE list_id = ? AND id > ? ORDER BY id LIMIT ?", (self.list_id, last_id, batch_size)
+                )
+                for show_id, doc in rows:
+                    show = json.loads(doc)
+                    if projected:
+                        yield project_show(show_id, show)
+                    else:
+                        show["id"] = show_id
+                        yield show
+                if len(rows) < batch_size:
+                    return
+                last_id = rows[-1][0]
+
+    # Changes in (rev, id) order from the rev indexes, in one snapshot like iter_shows
+    async def iter_changes(self, since, batch_size=1000):
+        async with self._snapshot() as connection:
+            rows = await connection.execute_fetchall("SELECT version FROM meta WHERE key = ?", (f"reset:{self.list_id}",))
+            if rows and since < rows[0][0]:
+                raise ListReplacedError(self.list_id)
+            for table, columns in (("shows", "id, rev, doc"), ("tombstones", "id, rev, deleted_at")):
+                condition, params = "rev > ?", (since,)
+                while True:
+                    rows = await connection.execute_fetchall(
+                        f"SELECT {columns} FROM {table} WHERE list_id = ? AND ({condition}) ORDER BY rev, id LIMIT ?",
+                        (self.list_id,) + params + (batch_size,),
+                    )
+                    for row in rows:
+                        yield read_row(row) if table == "shows" else tombstone(*row)
+                    if len(rows) < batch_size:
+                        break
+                    condition, params = "rev > ? OR (rev = ? AND id > ?)", (rows[-1][1], rows[-1][1], rows[-1][0])
+
+    # Titles starting with the query are a range of the title_norm index
+    async def search(self, query, limit):
+        async with self._reading() as connection:
+            rows = await connection.execute_fetchall(
+                "SELECT id, rev, doc FROM shows WHERE list_id = ? AND title_norm >= ? AND title_norm < ? ORDER BY title_norm LIMIT ?",
+                (self.list_id, query, prefix_end(query), limit),
+            )
+        return [read_row(row) for row in rows]
+
+    async def suggest(self, query, limit):
+        async with self._reading() as connection:
+            rows = await connection.execute_fetchall(
+                "SELECT title FROM shows WHERE list_id = ? AND title_norm >= ? AND title_norm < ? ORDER BY title_norm LIMIT ?",
+                (self.list_id, query, prefix_end(query), limit),
+            )
+        return [title for (title,) in rows]
+
+    async def load_stats(self):
+        async with self._reading() as connection:
+            rows = await connection.execute_fetchall("SELECT status, count, episodes FROM stats WHERE list_id = ?", (self.list_id,))
+        return [{"status": status, "count": count, "episodes": episodes} for status, count, episodes in rows]
+
+    async def compute_stats(self):
+        async with self._reading() as connection:
+            rows = await connection.execute_fetchall(COMPUTE_STATS, (self.list_id,))
+        return [{"status": status, "count": count, "episodes": episodes} for status, count, episodes in rows]
+
+    async def rebuild_stats(self):
+        async with self._writing() as connection:
+            for statement in REBUILD_STATS:
+                await connection.execute(statement, (self.list_id,))
+            rows = await connection.execute_fetchall("SELECT status, count, episodes FROM stats WHERE list_id = ?", (self.list_id,))
+        return [{"status": status, "count": count, "episodes": episodes} for status, count, episodes in rows]
@@ -0,0 +1,252 @@
+import json
+import re
+from datetime import datetime, timezone
+
+# Fields of a show that the API reads and writes, besides its id.
+SHOW_FIELDS = ("title", "status", "current_episode")
+
+# Fields GET /shows/ can sort on.
+SORT_FIELDS = ("title", "status", "current_episode")
+
+# List of shows used by requests that name none, which holds the shows written before lists existed.
+DEFAULT_LIST = "default"
+
+# Reason an imported row is rejected when an earlier row of the file has its title.
+DUPLICATE_TITLE = "Duplicate title in the file"
+
+# Ids a list may have. They are used in collection names, so they are kept short and plain.
+LIST_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+class StorageError(Exception):
+    pass
+
+
+class DuplicateTitleError(StorageError):
+    pass
+
+
+# Raised by writes to a list that holds shows sharing a title, stored before titles were
+# unique, until they are renamed or deleted
+class TitlesNotUniqueError(StorageError):
+    pass
+
+
+class ChangeStreamUnavailable(StorageError):
+    pass
+
+
+# Raised by an export whose list was cleared or imported over while it was read
+class ListReplacedError(StorageError):
+    pass
+
+
+# Search key of a title, matching Mongo's $toLower used for the startup backfill
+def normalize_title(title):
+    return title.lower()
+
+
+# Value of a field as stored in an indexed column. Numbers and strings are kept as they are,
+# anything else an import may bring in is stored as its JSON text.
+def column_value(value):
+    if value is None or isinstance(value, (str, float)):
+        return value
+    if isinstance(value, int):
+        return int(value) if -2 ** 63 <= value < 2 ** 63 else str(value)
+    return json.dumps(value, sort_keys=True)
+
+
+# Sort key of a field value: missing values first, then numbers, then strings,
+# which is the order Mongo and SQLite use too.
+def sort_value(value):
+    value = column_value(value)
+    if value is None:
+        return (0,)
+    if isinstance(value, str):
+        return (2, value)
+    return (1, value)
+
+
+# Time of a write, stored as updated_at on shows and deleted_at on tombstones
+def timestamp():
+    return datetime.now(timezone.utc).isoformat()
+
+
+# Episode of a show after a progress update: increment is added to it, then it is raised
+# to at least at_least when given
+def advanced_episode(current, increment, at_least=None):
+    episode = (current or 0) + increment
+    return episode if at_least is None else max(episode, at_least)
+
+
+# Episodes a show adds to the episode totals of the statistics. Only numbers count,
+# anything else an import may bring in counts as 0.
+def episode_count(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return 0
+
+
+# Record of a deleted show, as returned with the changes since a revision
+def tombstone(show_id, rev, deleted_at):
+    return {"id": show_id, "rev": rev, "deleted": True, "deleted_at": deleted_at}
+
+
+# A show reduced to the fields of the Show model, for the fast serialization path
+def project_show(show_id, show):
+    projected = {"id": show_id}
+    for field in SHOW_FIELDS:
+        if field in show:
+            projected[field] = show[field]
+    return projected
+
+
+# Interface of the places shows are stored.
+# Shows are passed in and out as dicts. Returned shows carry their id as an ObjectId hex
+# string and their revision as rev. A position in a sort order, as held by a list cursor,
+# is a dict with the id of the last show and, when sorting on a field, its value as key.
+# Shows are kept in lists, each with its own shows, version, tombstones and statistics. A
+# repository works on the list named by list_id, and for_list gives the same storage scoped
+# to another list.
+class ShowRepository:
+    name = None
+    list_id = DEFAULT_LIST
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    # The storage scoped to another list, sharing this repository's connections
+    def for_list(self, list_id):
+        raise NotImplementedError
+
+    # Version counter of the shows, as an (epoch, version) pair. The epoch is None for a list
+    # never written to, and reading it stores nothing.
+    async def load_version(self):
+        raise NotImplementedError
+
+    # Increment the version and return the new (epoch, version) pair, creating the counter
+    # of a new list
+    async def allocate_version(self):
+        raise NotImplementedError
+
+    async def commit_version(self):
+        raise NotImplementedError
+
+    # Delete every show and every tombstone. rev is kept as the reset revision, changes since
+    # an earlier revision can no longer be listed.
+    async def clear(self, rev=0):
+        raise NotImplementedError
+
+    # Revision of the last clear, 0 if there was none
+    async def load_reset_rev(self):
+        raise NotImplementedError
+
+    # Store a new show and return it. Raises DuplicateTitleError.
+    async def create(self, show, rev):
+        raise NotImplementedError
+
+    async def get(self, show_id):
+        raise NotImplementedError
+
+    # Shows with the given ids, keyed by id
+    async def get_many(self, show_ids):
+        raise NotImplementedError
+
+    async def list_shows(self, status=None, sort=None, order="asc", after=None, skip=0, limit=10, projected=False):
+        raise NotImplementedError
+
+    # Set the given fields of a show and return it, or None if it does not exist. Raises DuplicateTitleError.
+    async def update(self, show_id, fields, rev):
+        raise NotImplementedError
+
+    # Move a show's current_episode as advanced_episode does, in one atomic update, and return
+    # the show, or None if it does not exist
+    async def advance_episode(self, show_id, increment, at_least, rev, updated_at):
+        raise NotImplementedError
+
+    # Delete a show, leaving a tombstone with the given rev, and return it, or None if it does not exist
+    async def delete(self, show_id, rev):
+        raise NotImplementedError
+
+    # Store many new shows. Returns the created shows and the (status_code, detail) of
+    # the failed ones, both keyed by their index in shows.
+    async def create_many(self, shows, rev):
+        raise NotImplementedError
+
+    # Apply many (show_id, fields) updates. Returns the (status_code, detail) of the failed
+    # ones keyed by their index in updates. Missing shows are not an error.
+    async def update_many(self, updates, rev):
+        raise NotImplementedError
+
+    # Delete many shows, leaving a tombstone for each
+    async def delete_many(self, show_ids, rev):
+        raise NotImplementedError
+
+    # Start an import into an empty staging area, kept apart from the shows until committed.
+    # Returns the staging area, opaque to the caller.
+    async def stage_import(self):
+        raise NotImplementedError
+
+    # Insert or replace imported shows by id in a staging area. Returns the inserted and
+    # updated counts, and the (position, detail) errors of the shows rejected, by their
+    # position in shows.
+    async def import_batch(self, shows, staging):
+        raise NotImplementedError
+
+    # Replace all shows with those of the staging area in one step, like clear(rev) followed
+    # by the import, with readers seeing either the old shows or the new ones. Every imported
+    # show is given rev, which is allocated once the import is complete.
+    async def commit_import(self, staging, rev):
+        raise NotImplementedError
+
+    # Drop a staging area, leaving the shows as they were
+    async def discard_import(self, staging):
+        raise NotImplementedError
+
+    # All shows as exported, without the fields kept for the storage's own use. The shows are
+    # those of a single moment: either the list before a clear or an import, or after it. A
+    # storage that cannot read them in one snapshot raises ListReplacedError instead.
+    async def iter_shows(self, projected=False, batch_size=1000):
+        raise NotImplementedError
+        yield
+
+    # Shows written after the given revision in rev order, with their rev, then the tombstones
+    # of the shows deleted after it, read like iter_shows. Raises ListReplacedError when the
+    # list was cleared or imported over after that revision.
+    async def iter_changes(self, since, batch_size=1000):
+        raise NotImplementedError
+        yield
+
+    # Shows whose normalized title starts with the query, in title order. Only prefixes are
+    # matched, as a range of the title index; a substring match would scan every title.
+    async def search(self, query, limit):
+        raise NotImplementedError
+
+    # Titles whose normalized title starts with the query
+    async def suggest(self, query, limit):
+        raise NotImplementedError
+
+    # Count and episode total of the shows of each status, as {"status", "count", "episodes"}
+    # dicts, read from the summary the writes keep up to date. Statuses that are not strings
+    # are given as their column_value.
+    async def load_stats(self):
+        raise NotImplementedError
+
+    # Recompute the summary from the shows and return it as load_stats does, storing nothing
+    async def compute_stats(self):
+        raise NotImplementedError
+
+    # Recompute the summary from the shows, store it in place of the kept one and return it
+    async def rebuild_stats(self):
+        raise NotImplementedError
+
+    # Publish the changes made by every worker to the change brokers of their lists, for as long
+    # as possible. Raises ChangeStreamUnavailable when the storage cannot see other workers' writes.
+    async def watch(self, brokers):
+        raise ChangeStreamUnavailable(f"the {self.name} backend has no change stream")
+
+    def pool_stats(self):
+        return {"backend": self.name}
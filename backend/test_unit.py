@@ -1,136 +1,38 @@
+import asyncio
+import gzip
 import json
 import os
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+import pytest
+from bson import ObjectId
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String
-from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from typing import List
-from fastapi import FastAPI, HTTPException, Depends, Response, status, UploadFile, File
-from fastapi.responses import FileResponse
-
-# SQLAlchemy setup
-DATABASE_URL = "sqlite:///./test.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-# Pydantic models
-class ShowBase(BaseModel):
-    title: str
-    status: str
-    current_episode: int
-
-class Show(ShowBase):
-    id: int
-
-    class Config:
-        orm_mode = True
-
-class ShowCreate(BaseModel):
-    title: str
-    status: str
-    current_episode: int
-
-class ShowUpdate(BaseModel):
-    status: str
-    current_episode: int
-
-# SQLAlchemy model
-class DBShow(Base):
-    __tablename__ = "shows"
-    id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True)
-    status = Column(String)
-    current_episode = Column(Integer)
-
-# FastAPI setup
-app = FastAPI()
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-@app.post("/shows/", response_model=Show, status_code=status.HTTP_201_CREATED)
-def create_show(show: ShowCreate, db: Session = Depends(get_db)):
-    db_show = DBShow(**show.dict())
-    db.add(db_show)
-    db.commit()
-    db.refresh(db_show)
-    return Show(**db_show.__dict__)
-
-@app.get("/shows/{show_id}", response_model=Show)
-def read_show(show_id: int, db: Session = Depends(get_db)):
-    db_show = db.query(DBShow).filter(DBShow.id == show_id).first()
-    if db_show is None:
-        raise HTTPException(status_code=404, detail="Show not found")
-    return db_show
-
-@app.get("/shows/", response_model=List[Show])
-def read_shows(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    shows = db.query(DBShow).offset(skip).limit(limit).all()
-    return shows
-
-@app.put("/shows/{show_id}", response_model=Show)
-def update_show(show_id: int, show: ShowUpdate, db: Session = Depends(get_db)):
-    db_show = db.query(DBShow).filter(DBShow.id == show_id).first()
-    if db_show is None:
-        raise HTTPException(status_code=404, detail="Show not found")
-    for key, value in show.dict().items():
-        setattr(db_show, key, value)
-    db.commit()
-    db.refresh(db_show)
-    return db_show
-
-@app.delete("/shows/{show_id}", response_model=Show)
-def delete_show(show_id: int, db: Session = Depends(get_db)):
-    db_show = db.query(DBShow).filter(DBShow.id == show_id).first()
-    if db_show is None:
-        raise HTTPException(status_code=404, detail="Show not found")
-    db.delete(db_show)
-    db.commit()
-    return db_show
-
-@app.get("/export/")
-def export_shows(db: Session = Depends(get_db)):
-    shows = db.query(DBShow).all()
-    shows_dict = [show.__dict__ for show in shows]
-    for show in shows_dict:
-        show.pop('_sa_instance_state', None)
-    
-    with open("shows.json", "w") as f:
-        json.dump(shows_dict, f, indent=4)
-    
-    response = FileResponse("shows.json", media_type="application/json")
-    response.headers["Content-Disposition"] = "attachment; filename=shows.json"
-    
-    return response
+from httpx import AsyncClient
+from main import app, read_cache, shows_version
+from memory_storage import MemoryShowRepository
+from importer import JSONArrayParser
+from exporter import iter_export
+from cache import ReadCache
+from admission import AdmissionLimit, AdmissionMiddleware
+from events import ChangeBroker, ChangeBrokers
+from bench import run_benchmark
+from metrics import Registry
+from profiling import ProfilingMiddleware
+from progress import ProgressBuffer, compose_progress
+from mongo_storage import MongoShowRepository
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from storage import DuplicateTitleError, TitlesNotUniqueError
+import main
 
-@app.post("/import/")
-def import_shows(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    content = file.file.read()
-    shows_dict = json.loads(content)
-    
-    for show_data in shows_dict:
-        show = db.query(DBShow).filter(DBShow.id == show_data["id"]).first()
-        if not show:
-            new_show = DBShow(**show_data)
-            db.add(new_show)
-        else:
-            for key, value in show_data.items():
-                setattr(show, key, value)
-    
-    db.commit()
-    return {"detail": "Shows imported successfully"}
+# The app under test keeps its shows in memory
+repository = MemoryShowRepository()
 
-# Ensure tables are created
-Base.metadata.create_all(bind=engine)
+@pytest.fixture(autouse=True)
+def use_repository():
+    asyncio.run(repository.clear())
+    app.state.repository = repository
+    read_cache.clear()
+    asyncio.run(shows_version.load(repository))
+    yield
 
 # Test setup
 client = TestClient(app)
@@ -168,13 +70,167 @@ def test_update_show():
     show_id = create_show("Test Show", "watching", 1)
 
     # Update the show
-    update_response = client.put(f"/shows/{show_id}", json={"status": "completed", "current_episode": 10})
+    update_response = client.put(f"/shows/{show_id}", json={"title": "Test Show", "status": "completed", "current_episode": 10})
     assert update_response.status_code == 200
     updated_show = update_response.json()
     assert updated_show["id"] == show_id
     assert updated_show["status"] == "completed"
     assert updated_show["current_episode"] == 10
 
+def test_progress_increments_and_raises_episode():
+    show_id = create_show("Progress Show", "watching", 3)
+
+    response = client.post(f"/shows/{show_id}/progress", json={})
+    assert response.status_code == 200 and response.json()["current_episode"] == 4
+    assert client.post(f"/shows/{show_id}/progress", json={"episode": 2}).json()["current_episode"] == 4
+    assert client.post(f"/shows/{show_id}/progress", json={"increment": 2, "episode": 9}).json()["current_episode"] == 9
+    assert client.get(f"/shows/{show_id}").json()["current_episode"] == 9
+    assert client.post(f"/shows/{str(ObjectId())}/progress", json={}).status_code == 404
+
+def test_progress_buffer_merges_updates(monkeypatch):
+    show_id = create_show("Buffered Show", "watching", 1)
+    monkeypatch.setattr(main.progress_buffer, "interval", 0.05)
+
+    for body in [{}, {"increment": 2}, {"episode": 3}, {}]:
+        response = client.post(f"/shows/{show_id}/progress", json=body)
+        assert response.status_code == 202
+    assert main.progress_buffer.pending == {("default", show_id): (4, 4)}
+    assert client.get(f"/shows/{show_id}").json()["current_episode"] == 1
+
+    asyncio.run(main.flush_progress(repository))
+    assert client.get(f"/shows/{show_id}").json()["current_episode"] == 5
+    # Merged updates have the effect of the updates applied one by one
+    for first, second, episode in [((1, None), (0, 7), 6), ((2, 5), (1, None), 8), ((0, 9), (-1, 2), 4)]:
+        merged = compose_progress(first, second)
+        one_by_one = max(max(episode + first[0], first[1] or -10 ** 9) + second[0], second[1] or -10 ** 9)
+        assert max(episode + merged[0], merged[1] if merged[1] is not None else -10 ** 9) == one_by_one
+
+def test_progress_buffer_keeps_updates_a_flush_could_not_write(monkeypatch):
+    first_id = create_show("Unflushed Show 1", "watching", 1)
+    second_id = create_show("Unflushed Show 2", "watching", 1)
+    monkeypatch.setattr(main.progress_buffer, "interval", 0.05)
+    for show_id in [first_id, second_id]:
+        assert client.post(f"/shows/{show_id}/progress", json={"increment": 2}).status_code == 202
+
+    advance_episode = repository.advance_episode
+    async def fail_second(show_id, *args):
+        if show_id == second_id:
+            raise RuntimeError("write failed")
+        return await advance_episode(show_id, *args)
+    monkeypatch.setattr(repository, "advance_episode", fail_second)
+    with pytest.raises(RuntimeError):
+        asyncio.run(main.flush_progress(repository))
+    # The written update is not written again, the other one is merged with those received since
+    assert client.post(f"/shows/{second_id}/progress", json={"episode": 5}).status_code == 202
+    assert main.progress_buffer.pending == {("default", second_id): (2, 5)}
+
+    monkeypatch.setattr(repository, "advance_episode", advance_episode)
+    asyncio.run(main.flush_progress(repository))
+    assert client.get(f"/shows/{first_id}").json()["current_episode"] == 3
+    assert client.get(f"/shows/{second_id}").json()["current_episode"] == 5
+
+def test_progress_buffer_stop_waits_for_the_flush_in_progress():
+    buffer = ProgressBuffer(0.01)
+    written = []
+    async def flush():
+        pending = buffer.take()
+        await asyncio.sleep(0.05)
+        written.append(pending)
+    async def run():
+        buffer.add("show", 1, None)
+        runner = asyncio.create_task(buffer.run(flush))
+        while buffer.pending:
+            await asyncio.sleep(0.001)
+        await buffer.stop(runner)
+    asyncio.run(run())
+    assert written == [{"show": (1, None)}]
+
+def test_titles_stay_unique_across_creates_and_updates():
+    first_id = create_show("Unique Show", "watching", 1)
+    second_id = create_show("Other Show", "watching", 1)
+    response = client.post("/shows/", json={"title": "Unique Show", "status": "completed", "current_episode": 2})
+    assert (response.status_code, response.json()["detail"]) == (400, "Show with this title already exists")
+    response = client.put(f"/shows/{second_id}", json={"title": "Unique Show", "status": "watching", "current_episode": 1})
+    assert (response.status_code, response.json()["detail"]) == (400, "Show with this title already exists")
+
+    # A show keeps its own title, and a deleted show's title is free again
+    response = client.put(f"/shows/{first_id}", json={"title": "Unique Show", "status": "completed", "current_episode": 9})
+    assert response.status_code == 200
+    assert client.delete(f"/shows/{first_id}").status_code == 200
+    create_show("Unique Show", "watching", 1)
+
+def test_mongo_builds_the_indexes_of_a_list_before_its_first_write():
+    class Shows:
+        indexes = []
+
+        async def create_indexes(self, indexes):
+            Shows.indexes.append([index.document["name"] for index in indexes])
+
+        async def insert_one(self, document):
+            raise DuplicateKeyError("E11000 duplicate key error", 11000)
+
+    class Tombstones:
+        async def create_indexes(self, indexes):
+            pass
+
+    mongo = MongoShowRepository("mongodb://localhost", "shows")
+    mongo.db = {"shows": Shows(), "tombstones": Tombstones()}
+    for attempt in range(2):
+        with pytest.raises(DuplicateTitleError):
+            asyncio.run(mongo.create({"title": "Taken", "status": "watching", "current_episode": 1}, 1))
+    assert len(Shows.indexes) == 1
+    assert Shows.indexes[0][0] == "title_unique"
+    assert "status_id" in Shows.indexes[0]
+
+def test_mongo_writes_conflict_while_stored_titles_are_not_unique(monkeypatch):
+    # A legacy collection holding two shows titled "Twin" fails to build the unique title index
+    class LegacyShows:
+        builds = 0
+
+        async def create_indexes(self, indexes):
+            LegacyShows.builds += 1
+            message = 'E11000 duplicate key error collection: shows index: title_unique dup key: { title: "Twin" }'
+            raise OperationFailure(message, 11000, {"errmsg": message, "code": 11000})
+
+    mongo = MongoShowRepository("mongodb://localhost", "shows")
+    mongo.db = {"shows": LegacyShows()}
+    show = {"title": "New", "status": "watching", "current_episode": 1}
+    for attempt in range(2):
+        with pytest.raises(TitlesNotUniqueError, match='title: "Twin"'):
+            asyncio.run(mongo.create(dict(show), 1))
+    # The index build is not tried again on every write
+    assert LegacyShows.builds == 1
+
+    async def refuse(*args):
+        raise TitlesNotUniqueError("Shows of list default share a title")
+    monkeypatch.setattr(repository, "create", refuse)
+    monkeypatch.setattr(repository, "update", refuse)
+    response = client.post("/shows/", json=show)
+    assert (response.status_code, response.json()["detail"]) == (409, "Shows of list default share a title")
+    assert client.put(f"/shows/{str(ObjectId())}", json=show).status_code == 409
+
+def test_stats_follow_writes():
+    first_id = create_show("Stats Show 1", "watching", 4)
+    second_id = create_show("Stats Show 2", "watching", 2)
+    create_show("Stats Show 3", "completed", 10)
+    client.put(f"/shows/{second_id}", json={"title": "Stats Show 2", "status": "completed", "current_episode": 12})
+    client.post(f"/shows/{first_id}/progress", json={"increment": 2})
+    client.delete(f"/shows/{first_id}")
+
+    stats = client.get("/shows/stats").json()
+    assert (stats["total"], stats["episodes"], stats["average_episode"]) == (2, 22, 11)
+    assert [(row["status"], row["count"], row["episodes"]) for row in stats["statuses"]] == [("completed", 2, 22)]
+
+    # Verifying reports the drift without repairing it, which takes a rebuild
+    repository.stats["completed"][0] = 5
+    for attempt in range(2):
+        stats = client.get("/shows/stats", params={"verify": True}).json()
+        assert stats["consistent"] is False and stats["total"] == 2
+    assert client.get("/shows/stats").json()["total"] == 5
+    stats = client.post("/shows/stats/rebuild").json()
+    assert stats["consistent"] is False and stats["total"] == 2
+    assert client.get("/shows/stats", params={"verify": True}).json()["consistent"] is True
+
 def test_delete_show():
     # Create a show first
     show_id = create_show("Test Show to Delete", "watching", 1)
@@ -190,23 +246,132 @@ def test_delete_show():
     assert not show_exists(show_id), f"Show with ID {show_id} still exists but should have been deleted."
 
 def test_export_shows():
+    create_show("Test Show to Export", "watching", 1)
+
     response = client.get("/export/")
     assert response.status_code == 200
     assert response.headers["content-type"] == "application/json"
-    assert "attachment; filename=shows.json" in response.headers["content-disposition"]
+    assert 'attachment; filename="shows.json"' in response.headers["content-disposition"]
+
+    exported_data = response.json()
+    assert isinstance(exported_data, list)
+    assert all(isinstance(show, dict) for show in exported_data)
+    assert exported_data[0]["title"] == "Test Show to Export"
+
+def test_fast_serialization_matches_validated_output(monkeypatch):
+    shows = [
+        {"id": str(ObjectId()), "title": f"Fast Show {i} ✓", "status": "watching" if i % 2 else "completed", "current_episode": i, "notes": None, "rating": i / 2}
+        for i in range(5)
+    ]
+    client.post("/import/", files={"file": ("shows.json", json.dumps(shows), "application/json")})
+
+    def read_all(fast):
+        monkeypatch.setattr(main, "FAST_SERIALIZATION", fast)
+        read_cache.clear()
+        pages = [client.get("/shows/", params=params) for params in [{"limit": 3}, {"sort": "current_episode", "order": "desc"}, {"status": "watching"}]]
+        exports = {export_format: client.get("/export/", params={"format": export_format}) for export_format in ("ndjson", "csv")}
+        return pages, exports
+
+    fast_pages, fast_exports = read_all(True)
+    pages, exports = read_all(False)
+    for fast_page, page in zip(fast_pages, pages):
+        # Same shows, fields and field order as the response_model output
+        assert [list(show.items()) for show in fast_page.json()] == [list(show.items()) for show in page.json()]
+        assert fast_page.headers["content-type"] == page.headers["content-type"]
+        assert fast_page.headers.get("x-next-cursor") == page.headers.get("x-next-cursor")
+    # The fast export holds the stored shows validated against Show, and the csv columns are the same
+    validated = [main.Show.model_validate(json.loads(line)).model_dump() for line in exports["ndjson"].text.splitlines()]
+    assert [json.loads(line) for line in fast_exports["ndjson"].text.splitlines()] == validated
+    assert fast_exports["csv"].text == exports["csv"].text
+
+def test_export_since_returns_changes_and_tombstones():
+    kept_id = create_show("Sync Show", "watching", 1)
+    deleted_id = create_show("Sync Show 2", "watching", 1)
+    response = client.get("/export/")
+    since = response.headers["x-export-since"]
+
+    client.put(f"/shows/{kept_id}", json={"title": "Sync Show", "status": "completed", "current_episode": 9})
+    client.delete(f"/shows/{deleted_id}")
+    new_id = create_show("Sync Show 3", "watching", 1)
+
+    response = client.get("/export/", params={"since": since, "format": "ndjson"})
+    assert response.status_code == 200
+    changes = [json.loads(line) for line in response.text.splitlines()]
+    assert [change["id"] for change in changes] == [kept_id, new_id, deleted_id]
+    assert changes[0]["current_episode"] == 9 and "updated_at" in changes[0]
+    assert changes[2]["deleted"] is True
+
+    response = client.get("/export/", params={"since": response.headers["x-export-since"]})
+    assert all(change["id"] == new_id for change in response.json())
+
+    client.post("/create-shows-list/")
+    assert client.get("/export/", params={"since": since}).status_code == 410
+
+def test_export_since_waits_for_writes_in_flight(monkeypatch):
+    create = repository.create
+    slow = asyncio.Event()
+
+    async def create_slowly(show, rev):
+        if show["title"] == "Slow Show":
+            await slow.wait()
+        return await create(show, rev)
+
+    monkeypatch.setattr(repository, "create", create_slowly)
 
-    with open("shows.json", "r") as f:
-        exported_data = json.load(f)
-        assert isinstance(exported_data, list)
-        assert all(isinstance(show, dict) for show in exported_data)
+    async def scenario():
+        async with AsyncClient(app=app, base_url="http://test") as async_client:
+            since = (await async_client.get("/export/")).headers["x-export-since"]
+            # The slow show holds the first revision while the fast one commits a later one
+            pending = asyncio.ensure_future(async_client.post("/shows/", json={"title": "Slow Show", "status": "watching", "current_episode": 1}))
+            await asyncio.sleep(0.01)
+            await async_client.post("/shows/", json={"title": "Fast Show", "status": "watching", "current_episode": 1})
+            response = await async_client.get("/export/", params={"since": since})
+            assert [show["title"] for show in response.json()] == ["Fast Show"]
+            assert response.headers["x-export-since"] == since
 
-    os.remove("shows.json")
+            slow.set()
+            await pending
+            response = await async_client.get("/export/", params={"since": response.headers["x-export-since"]})
+            assert sorted(show["title"] for show in response.json()) == ["Fast Show", "Slow Show"]
+
+    asyncio.run(scenario())
+
+def test_export_since_during_an_import_is_gone_after_it(monkeypatch):
+    create_show("Old Show", "watching", 1)
+    import_batch = repository.import_batch
+    written = asyncio.Event()
+    finish = asyncio.Event()
+
+    async def import_slowly(shows, staging):
+        counts = await import_batch(shows, staging)
+        written.set()
+        await finish.wait()
+        return counts
+
+    monkeypatch.setattr(repository, "import_batch", import_slowly)
+    shows = [{"id": str(ObjectId()), "title": "New Show", "status": "watching", "current_episode": 1}]
+
+    async def scenario():
+        async with AsyncClient(app=app, base_url="http://test") as async_client:
+            pending = asyncio.ensure_future(async_client.post("/import/", files={"file": ("shows.json", json.dumps(shows), "application/json")}))
+            await written.wait()
+            since = (await async_client.get("/export/")).headers["x-export-since"]
+            finish.set()
+            assert (await pending).status_code == 201
+
+            # The imported shows are newer than any export made while the import ran
+            assert (await async_client.get("/export/", params={"since": since})).status_code == 410
+            response = await async_client.get("/export/")
+            assert [show["title"] for show in response.json()] == ["New Show"]
+            assert (await async_client.get("/export/", params={"since": response.headers["x-export-since"]})).json() == []
+
+    asyncio.run(scenario())
 
 def test_import_shows():
     # Create a temporary test_data.json file for import testing
     test_data = [
-        {"id": 1, "title": "Test Show 1", "status": "watching", "current_episode": 1},
-        {"id": 2, "title": "Test Show 2", "status": "completed", "current_episode": 10}
+        {"id": str(ObjectId()), "title": "Test Show 1", "status": "watching", "current_episode": 1},
+        {"id": str(ObjectId()), "title": "Test Show 2", "status": "completed", "current_episode": 10}
     ]
     
     with NamedTemporaryFile(delete=False) as temp_file:
@@ -218,6 +383,643 @@ def test_import_shows():
     
     os.remove(temp_file.name)  # Remove the temporary test_data.json file after import test
     
-    assert response.status_code == 200
+    assert response.status_code == 201
     assert "detail" in response.json()
-    assert "imported successfully" in response.json()["detail"]
\ No newline at end of file
+    assert "imported successfully" in response.json()["detail"]
+
+def test_import_shows_reports_counts():
+    # Rows are written in batches smaller than the file and counted by outcome
+    first_id = str(ObjectId())
+    test_data = [
+        {"id": first_id, "title": "Import Show", "status": "watching", "current_episode": 1},
+        {"id": first_id, "title": "Import Show", "status": "completed", "current_episode": 12},
+        {"id": str(ObjectId()), "title": "Import New Show", "status": "watching", "current_episode": 2},
+        {"title": "Import Show Without Id", "status": "watching", "current_episode": 3},
+        "not a show",
+    ]
+
+    files = {"file": ("shows.json", json.dumps(test_data), "application/json")}
+    response = client.post("/import/?batch_size=1", files=files)
+
+    assert response.status_code == 201
+    counts = response.json()
+    assert counts["inserted"] == 2
+    assert counts["updated"] == 0
+    assert counts["rejected"] == 3
+    # A row repeating the id of an earlier row is rejected, the first one is imported
+    assert client.get(f"/shows/{first_id}").json()["current_episode"] == 1
+    assert counts["errors"] == [
+        {"row": 1, "detail": "Duplicate id in the file"},
+        {"row": 3, "detail": "id: Field required"},
+        {"row": 4, "detail": "Not a JSON object"},
+    ]
+
+def test_import_validates_rows_against_the_show_schema():
+    test_data = [
+        {"id": str(ObjectId()), "title": "Valid", "status": "watching", "current_episode": 1, "rating": 5},
+        {"id": str(ObjectId()), "title": "Valid", "status": "watching", "current_episode": 2},
+        {"id": "not-an-id", "title": "Bad Id", "status": "watching", "current_episode": 1},
+        {"id": str(ObjectId()), "title": "Bad Types", "status": None, "current_episode": "3"},
+        {"id": str(ObjectId()), "status": "watching", "current_episode": True},
+    ]
+    files = {"file": ("shows.json", json.dumps(test_data), "application/json")}
+    report = client.post("/import/?batch_size=2", files=files).json()
+
+    assert (report["inserted"], report["rejected"]) == (1, 4)
+    assert report["errors"] == [
+        {"row": 1, "detail": "Duplicate title in the file"},
+        {"row": 2, "detail": "id: Not an ObjectId"},
+        {"row": 3, "detail": "status: Input should be a valid string; current_episode: Input should be a valid integer"},
+        {"row": 4, "detail": "title: Field required; current_episode: Input should be a valid integer"},
+    ]
+    # Fields outside the schema are kept as they are
+    assert client.get("/export/").json()[0]["rating"] == 5
+
+def test_import_reports_every_rejected_row_unless_capped(monkeypatch):
+    files = {"file": ("shows.json", json.dumps(["not a show"] * 250), "application/json")}
+    report = client.post("/import/", files=files).json()
+    assert [error["row"] for error in report["errors"]] == list(range(250))
+    assert report["errors_omitted"] == 0
+
+    monkeypatch.setattr(main, "IMPORT_MAX_ERRORS", 2)
+    report = client.post("/import/", files=files).json()
+    assert [error["row"] for error in report["errors"]] == [0, 1]
+    assert (report["rejected"], report["errors_omitted"]) == (250, 248)
+
+def test_import_batch_reports_the_shows_the_storage_rejects():
+    async def scenario():
+        staging = await repository.stage_import()
+        shows = [{"id": str(ObjectId()), "title": title, "status": "watching", "current_episode": 1} for title in ["A", "B", "A"]]
+        return await repository.import_batch(shows, staging)
+
+    counts, errors = asyncio.run(scenario())
+    assert counts == {"inserted": 2, "updated": 0}
+    assert errors == [(2, "Duplicate title in the file")]
+
+def test_import_job_reports_progress_and_can_be_cancelled():
+    test_data = [
+        {"id": str(ObjectId()), "title": "Job Show 1", "status": "watching", "current_episode": 1},
+        "not a show",
+        {"title": "Job Show Without Id", "status": "watching", "current_episode": 3},
+        {"id": str(ObjectId()), "title": "Job Show 2", "status": "completed", "current_episode": 10},
+    ]
+    files = {"file": ("shows.json", json.dumps(test_data), "application/json")}
+
+    async def run():
+        async with AsyncClient(app=app, base_url="http://test") as async_client:
+            response = await async_client.post("/import/jobs", params={"batch_size": 2}, files=files)
+            assert response.status_code == 202
+            job_url = response.headers["location"]
+            while (job := (await async_client.get(job_url)).json())["state"] in ("queued", "running"):
+                await asyncio.sleep(0.01)
+            page = (await async_client.get(job_url, params={"errors_offset": 1, "errors_limit": 1})).json()
+
+            response = await async_client.post("/import/jobs", params={"batch_size": 1}, files=files)
+            cancelled_url = response.headers["location"]
+            await async_client.delete(cancelled_url)
+            while (cancelled := (await async_client.get(cancelled_url)).json())["state"] in ("queued", "running"):
+                await asyncio.sleep(0.01)
+            return job, page, cancelled
+
+    job, page, cancelled = asyncio.run(run())
+    assert job["state"] == "completed" and job["progress"] == 1.0
+    assert (job["rows"], job["inserted"], job["rejected"]) == (4, 2, 2)
+    assert [error["row"] for error in job["errors"]] == [1, 2]
+    assert [error["row"] for error in page["errors"]] == [2]
+    assert cancelled["state"] == "cancelled" and cancelled["rows"] < 4
+    # The cancelled job left the shows of the completed one in place
+    assert sorted(show["title"] for show in client.get("/shows/").json()) == ["Job Show 1", "Job Show 2"]
+    assert client.get("/import/jobs/not-a-job").status_code == 404
+
+def test_import_rejects_invalid_json():
+    show_id = create_show("Show Kept", "watching", 1)
+    files = {"file": ("shows.json", "{not a list", "application/json")}
+    response = client.post("/import/", files=files)
+    assert response.status_code == 400
+
+    # A file failing halfway through changes nothing either
+    files = {"file": ("shows.json", json.dumps([{"id": str(ObjectId()), "title": "Half", "status": "watching"}])[:-1], "application/json")}
+    response = client.post("/import/?batch_size=1", files=files)
+    assert response.status_code == 400
+    assert [show["id"] for show in client.get("/shows/").json()] == [show_id]
+
+def test_json_array_parser_handles_split_chunks():
+    test_data = [{"id": i, "title": f"Show é {i}", "status": "watching", "current_episode": i} for i in range(20)]
+    content = json.dumps(test_data, indent=4).encode("utf-8")
+
+    parser = JSONArrayParser()
+    items = []
+    for i in range(0, len(content), 5):
+        items.extend(parser.feed(content[i:i + 5]))
+    items.extend(parser.close())
+
+    assert items == test_data
+
+def test_lists_are_kept_apart():
+    show_id = create_show("Shared Title", "watching", 1)
+    other = {"X-List-Id": "other"}
+    assert client.post("/create-shows-list/", headers=other).status_code == 201
+
+    # Titles are unique within a list only, and an import replaces its own list alone
+    response = client.post("/shows/", json={"title": "Shared Title", "status": "completed", "current_episode": 5}, headers=other)
+    assert response.status_code == 201
+    imported = json.dumps([{"id": show_id, "title": "Imported", "status": "watching", "current_episode": 2}])
+    response = client.post("/import/", files={"file": ("shows.json", imported, "application/json")}, headers=other)
+    assert response.json()["inserted"] == 1
+
+    assert [show["title"] for show in client.get("/shows/", headers=other).json()] == ["Imported"]
+    assert client.get(f"/shows/{show_id}", headers=other).json()["title"] == "Imported"
+    assert client.get(f"/shows/{show_id}").json()["title"] == "Shared Title"
+    assert client.get("/shows/stats", params={"list_id": "other"}).json()["episodes"] == 2
+    assert client.get("/shows/stats").json()["episodes"] == 1
+
+    # Emptying a list leaves the others as they were
+    assert client.post("/create-shows-list/", headers=other).status_code == 201
+    assert client.get("/shows/", headers=other).json() == []
+    assert show_exists(show_id)
+    assert client.get("/shows/", headers={"X-List-Id": "not a list"}).status_code == 400
+
+def test_reads_of_unknown_lists_keep_nothing():
+    unknown = {"X-List-Id": "never-written"}
+    for path in ["/shows/", f"/shows/{str(ObjectId())}", "/export/", "/events-stats/"]:
+        assert client.get(path, headers=unknown).status_code in (200, 404)
+    assert "never-written" not in repository.lists
+    assert "never-written" not in shows_version.lists
+    assert "never-written" not in main.change_brokers.lists
+
+    # A list this worker has not loaded yet, as when another worker wrote it
+    show_id = client.post("/shows/", json={"title": "Elsewhere", "status": "watching", "current_episode": 1}, headers=unknown).json()["id"]
+    del shows_version.lists["never-written"]
+    response = client.get(f"/shows/{show_id}", headers=unknown)
+    assert response.status_code == 200
+    assert response.headers["etag"].startswith(f'"{repository.lists["never-written"].epoch}.{show_id}.')
+
+def test_state_of_idle_lists_is_bounded(monkeypatch):
+    monkeypatch.setattr(shows_version, "max_lists", 10)
+    monkeypatch.setattr(read_cache, "max_namespaces", 16)
+    for i in range(30):
+        headers = {"X-List-Id": f"tenant-{i}"}
+        show_id = client.post("/shows/", json={"title": "Tenant Show", "status": "watching", "current_episode": 1}, headers=headers).json()["id"]
+        assert client.get(f"/shows/{show_id}", headers=headers).status_code == 200
+        assert client.get("/shows/", headers=headers).status_code == 200
+    # Nobody watched these lists, so no change feed was kept for them
+    assert not any(list_id.startswith("tenant-") for list_id in main.change_brokers.lists)
+    assert len(shows_version.lists) <= 10
+    assert read_cache.snapshot()["namespaces"] <= 16
+
+    # A forgotten list is loaded again, and its list ETag still follows its writes
+    headers = {"X-List-Id": "tenant-0"}
+    assert "tenant-0" not in shows_version.lists
+    etag = client.get("/shows/", headers=headers).headers["etag"]
+    assert client.get("/shows/", headers={**headers, "If-None-Match": etag}).status_code == 304
+    client.post("/shows/", json={"title": "Tenant Show 2", "status": "watching", "current_episode": 1}, headers=headers)
+    assert client.get("/shows/", headers={**headers, "If-None-Match": etag}).status_code == 200
+
+def test_change_brokers_forget_idle_lists(monkeypatch):
+    brokers = ChangeBrokers(idle_seconds=60, max_idle=2)
+    brokers.publish_write("unwatched", "create", {"id": "1"})
+    assert brokers.lists == {}
+
+    for list_id in ["a", "b", "c"]:
+        broker = brokers.get(list_id)
+        subscription = broker.subscribe()
+        brokers.publish_write(list_id, "create", {"id": "1"})
+        broker.unsubscribe(subscription)
+        brokers.release(list_id)
+    # Idle brokers are kept for clients resuming, up to max_idle of them
+    assert list(brokers.lists) == ["b", "c"]
+    resumed = brokers.get("c").subscribe(f"{brokers.lists['c'].epoch}-0")
+    assert resumed.queue.get_nowait().type == "create"
+    assert list(brokers.idle) == ["b"]
+
+    monkeypatch.setattr(brokers, "idle_seconds", 0)
+    brokers.release("c")
+    assert list(brokers.lists) == ["c"]
+
+def test_shows_are_filtered_and_sorted_by_status():
+    for title, status in [("Status A", "watching"), ("Status B", "completed"), ("Status C", "dropped"), ("Status D", "watching")]:
+        create_show(title, status, 1)
+
+    def titles(**params):
+        response = client.get("/shows/", params=params)
+        assert response.status_code == 200
+        return [show["title"] for show in response.json()]
+
+    assert titles(status="watching") == ["Status A", "Status D"]
+    assert titles(status="watching", skip=1) == ["Status D"]
+    assert titles(status="on hold") == []
+    assert titles(sort="status") == ["Status B", "Status C", "Status A", "Status D"]
+    assert titles(sort="status", order="desc") == ["Status D", "Status A", "Status C", "Status B"]
+    assert titles(status="watching", sort="title", order="desc") == ["Status D", "Status A"]
+    assert client.get("/shows/", params={"sort": "rating"}).status_code == 422
+    assert client.get("/shows/", params={"order": "up"}).status_code == 422
+
+def test_cursor_pages_follow_sort_order():
+    for title, episode in [("Cursor A", 3), ("Cursor B", 1), ("Cursor C", 3), ("Cursor D", 2), ("Cursor E", 5)]:
+        create_show(title, "watching" if episode != 5 else "completed", episode)
+
+    def walk(**params):
+        titles = []
+        response = client.get("/shows/", params={**params, "limit": 2})
+        while True:
+            assert response.status_code == 200
+            titles += [show["title"] for show in response.json()]
+            if "x-next-cursor" not in response.headers:
+                return titles
+            response = client.get("/shows/", params={**params, "limit": 2, "cursor": response.headers["x-next-cursor"]})
+
+    assert walk(sort="title", order="desc") == ["Cursor E", "Cursor D", "Cursor C", "Cursor B", "Cursor A"]
+    assert walk(sort="current_episode") == ["Cursor B", "Cursor D", "Cursor A", "Cursor C", "Cursor E"]
+    assert walk(status="watching", sort="current_episode", order="desc") == ["Cursor C", "Cursor A", "Cursor D", "Cursor B"]
+    assert client.get("/shows/", params={"cursor": "not a cursor"}).status_code == 400
+
+def test_cursors_resume_after_their_show_and_reject_tampering():
+    for title in ["Cursor A", "Cursor B", "Cursor C"]:
+        create_show(title, "watching", 2)
+
+    response = client.get("/shows/", params={"sort": "current_episode", "limit": 1})
+    cursor = response.headers["x-next-cursor"]
+    position = main.decode_cursor(cursor, "current_episode", "asc")
+    assert position == {"id": response.json()[0]["id"], "sort": "current_episode", "order": "asc", "key": 2}
+    assert main.encode_cursor(position) == cursor
+
+    # Shows with the same sort key continue in id order, none of them repeated
+    response = client.get("/shows/", params={"sort": "current_episode", "limit": 5, "cursor": cursor})
+    assert [show["title"] for show in response.json()] == ["Cursor B", "Cursor C"]
+    assert "x-next-cursor" not in response.headers
+
+    for tampered in [
+        cursor[:-2],
+        main.encode_cursor({**position, "id": "not an id"}),
+        main.encode_cursor({**position, "order": "desc"}),
+        main.encode_cursor({"sort": "current_episode", "order": "asc", "key": 2}),
+        main.encode_cursor(["not", "a", "position"]),
+    ]:
+        response = client.get("/shows/", params={"sort": "current_episode", "cursor": tampered})
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid cursor"
+    assert client.get("/shows/", params={"sort": "title", "cursor": cursor}).status_code == 400
+
+def test_list_etag_changes_on_write():
+    create_show("ETag Show", "watching", 1)
+    etag = client.get("/shows/").headers["etag"]
+    assert client.get("/shows/", headers={"If-None-Match": etag}).status_code == 304
+
+    create_show("ETag Show 2", "watching", 1)
+    response = client.get("/shows/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+
+def test_show_etag_answers_conditional_reads():
+    show_id = create_show("ETag Show", "watching", 1)
+    response = client.get(f"/shows/{show_id}")
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"] == "no-cache"
+
+    for if_none_match in [etag, f"W/{etag}", f'"other", {etag}', "*"]:
+        response = client.get(f"/shows/{show_id}", headers={"If-None-Match": if_none_match})
+        assert (response.status_code, response.headers["etag"], response.content) == (304, etag, b"")
+    assert client.get(f"/shows/{show_id}", headers={"If-None-Match": '"other"'}).status_code == 200
+
+    # Writes to other shows keep the ETag, writes to the show change it
+    create_show("Other ETag Show", "watching", 1)
+    assert client.get(f"/shows/{show_id}", headers={"If-None-Match": etag}).status_code == 304
+    client.post(f"/shows/{show_id}/progress", json={"increment": 1})
+    response = client.get(f"/shows/{show_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["etag"] != etag
+    assert response.json()["current_episode"] == 2
+
+def test_batch_endpoints_report_each_item():
+    response = client.post("/shows/batch", json=[
+        {"title": "Batch Show", "status": "watching", "current_episode": 1},
+        {"title": "Batch Show", "status": "watching", "current_episode": 2},
+    ])
+    assert [item["status_code"] for item in response.json()["results"]] == [201, 400]
+    show_id = response.json()["results"][0]["id"]
+
+    response = client.put("/shows/batch", json=[
+        {"id": show_id, "title": "Batch Show", "status": "completed", "current_episode": 8},
+        {"id": "bad id", "title": "Other", "status": "watching", "current_episode": 1},
+    ])
+    assert [item["status_code"] for item in response.json()["results"]] == [200, 400]
+
+    missing_id = str(ObjectId())
+    response = client.post("/shows/batch/get", json={"ids": [show_id, missing_id]})
+    assert [item["status_code"] for item in response.json()["results"]] == [200, 404]
+    assert response.json()["results"][0]["show"]["current_episode"] == 8
+
+    response = client.post("/shows/batch/delete", json={"ids": [show_id]})
+    assert response.json()["results"][0]["status_code"] == 200
+    assert not show_exists(show_id)
+
+def test_batches_are_bounded_and_report_bad_items(monkeypatch):
+    first_id = create_show("Batch A", "watching", 1)
+    second_id = create_show("Batch B", "watching", 1)
+
+    response = client.put("/shows/batch", json=[
+        {"id": second_id, "title": "Batch A", "status": "watching", "current_episode": 1},
+        {"id": str(ObjectId()), "title": "Batch C", "status": "watching", "current_episode": 1},
+        {"id": first_id, "title": "Batch A", "status": "completed", "current_episode": 3},
+    ])
+    assert [(item["status_code"], item.get("detail")) for item in response.json()["results"]] == [
+        (400, "Show with this title already exists"),
+        (404, "Show not found"),
+        (200, None),
+    ]
+    assert client.get(f"/shows/{second_id}").json()["title"] == "Batch B"
+
+    response = client.post("/shows/batch/delete", json={"ids": ["bad id", str(ObjectId()), second_id, second_id]})
+    assert [item["status_code"] for item in response.json()["results"]] == [400, 404, 200, 200]
+    assert [show["title"] for show in client.get("/shows/").json()] == ["Batch A"]
+
+    assert client.post("/shows/batch", json=[]).json() == {"results": []}
+    # A malformed item rejects the whole request, before anything is written
+    response = client.post("/shows/batch", json=[{"title": "Batch D", "status": "watching", "current_episode": 1}, {"title": "Batch E"}])
+    assert response.status_code == 422
+    assert len(client.get("/shows/").json()) == 1
+
+    monkeypatch.setattr(main, "BATCH_MAX_ITEMS", 2)
+    response = client.post("/shows/batch/get", json={"ids": [first_id] * 3})
+    assert (response.status_code, response.json()["detail"]) == (400, "A batch may hold at most 2 items")
+
+def test_search_lists_prefix_matches_in_title_order():
+    for title in ["The Office", "Office Space", "Back Office", "office hours", "Lost"]:
+        create_show(title, "watching", 1)
+
+    response = client.get("/shows/search", params={"q": "OFFICE"})
+    assert [show["title"] for show in response.json()] == ["office hours", "Office Space"]
+    assert client.get("/shows/search", params={"q": "OFFICE", "limit": 1}).json()[0]["title"] == "office hours"
+    assert client.get("/shows/suggest", params={"q": "the"}).json() == ["The Office"]
+
+def test_suggestions_are_ordered_limited_and_literal():
+    for title in ["Star Trek", "stargate", "Star Wars", "(Star) Dust", "Start Up", "Superstar"]:
+        create_show(title, "watching", 1)
+
+    assert client.get("/shows/suggest", params={"q": "Star"}).json() == ["Star Trek", "Star Wars", "stargate", "Start Up"]
+    assert client.get("/shows/suggest", params={"q": "star ", "limit": 1}).json() == ["Star Trek"]
+    assert client.get("/shows/suggest", params={"q": "(star"}).json() == ["(Star) Dust"]
+    assert client.get("/shows/suggest", params={"q": "dust"}).json() == []
+    assert client.get("/shows/suggest", params={"q": ""}).status_code == 422
+    assert client.get("/shows/suggest", params={"q": "star", "limit": 51}).status_code == 422
+    assert client.get("/shows/search", params={"q": "star", "limit": 101}).status_code == 422
+
+def test_metrics_report_routes_and_row_counts():
+    show_id = create_show("Metrics Show", "watching", 1)
+    client.get(f"/shows/{show_id}")
+    client.get("/export/?format=csv")
+
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/shows/{show_id}",status="200"}' in metrics.text
+    assert 'http_requests_in_progress{method="GET"} 1' in metrics.text
+    assert 'shows_exported_rows_total{format="csv"}' in metrics.text
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.histogram("command_seconds", "Command time.", ("command",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "find")
+    histogram.observe(0.5, "find")
+    histogram.observe(5, "find")
+
+    lines = registry.render().splitlines()
+    assert 'command_seconds_bucket{command="find",le="0.1"} 1' in lines
+    assert 'command_seconds_bucket{command="find",le="1"} 2' in lines
+    assert 'command_seconds_bucket{command="find",le="+Inf"} 3' in lines
+    assert 'command_seconds_count{command="find"} 3' in lines
+
+def test_profiling_saves_requests_with_the_token():
+    show_id = create_show("Profiled Show", "watching", 1)
+
+    with TemporaryDirectory() as directory:
+        profiled_client = TestClient(ProfilingMiddleware(app, directory=directory, token="secret"))
+        assert "x-profile-id" not in profiled_client.get(f"/shows/{show_id}").headers
+        assert "x-profile-id" not in profiled_client.get(f"/shows/{show_id}", headers={"X-Profile": "wrong"}).headers
+
+        read_cache.clear()
+        response = profiled_client.get(f"/shows/{show_id}", headers={"X-Profile": "secret"})
+        assert response.status_code == 200
+        profile_id = response.headers["x-profile-id"]
+        assert sorted(os.listdir(directory)) == [profile_id + ".json", profile_id + ".prof"]
+
+        with open(os.path.join(directory, profile_id + ".json")) as f:
+            summary = json.load(f)
+        assert summary["status"] == 200
+        assert summary["trigger"] == "header"
+        assert summary["storage"]["get"]["calls"] == 1
+        assert summary["wall_seconds"] >= summary["storage_seconds"]
+
+def test_benchmark_times_every_route(monkeypatch):
+    show_id = create_show("Kept Show", "watching", 1)
+    monkeypatch.setattr(main, "create_repository", lambda: repository)
+    report = asyncio.run(run_benchmark("memory", sizes=(20,), requests=5, concurrency=2, export_rounds=1))
+    results = report["sizes"]["20"]
+    assert "POST /import/" in results and "GET /shows/ cursor at depth" in results
+    assert all(result["errors"] == 0 for result in results.values())
+    assert all(result["p99_ms"] >= result["p50_ms"] for result in results.values())
+    # The benchmark works on a list of its own and leaves it empty
+    assert show_exists(show_id)
+    assert client.get("/shows/", headers={"X-List-Id": "bench"}).json() == []
+
+def test_streamed_json_export_matches_json_dump():
+    test_data = [
+        {"title": "Export Show \"1\"", "status": "watching", "current_episode": 1, "id": "a"},
+        {"title": "Export Show é", "status": "completed", "current_episode": 10, "id": "b"},
+    ]
+
+    async def shows(data):
+        for show in data:
+            yield show
+
+    async def export(data, **kwargs):
+        return b"".join([chunk async for chunk in iter_export(shows(data), "json", **kwargs)])
+
+    assert asyncio.run(export(test_data, chunk_size=1)) == json.dumps(test_data, indent=4).encode("utf-8")
+    assert asyncio.run(export([])) == b"[]"
+    assert gzip.decompress(asyncio.run(export(test_data, gzip=True))) == json.dumps(test_data, indent=4).encode("utf-8")
+
+def test_read_cache_evicts_expires_and_invalidates():
+    cache = ReadCache(max_entries=2, ttl_seconds=60)
+    cache.set(("show", "1"), {"id": "1"})
+    cache.set(("show", "2"), {"id": "2"})
+    assert cache.get(("show", "1")) == {"id": "1"}
+
+    # The least recently used entry is evicted first
+    cache.set(("list", None), [])
+    assert cache.get(("show", "2")) is None
+    assert cache.evictions == 1
+
+    cache.invalidate_namespace("list")
+    assert cache.get(("list", None)) is None
+    assert cache.get(("show", "1")) == {"id": "1"}
+
+    cache.ttl_seconds = 0
+    cache.set(("show", "3"), {"id": "3"})
+    assert cache.get(("show", "3")) is None
+    assert cache.snapshot()["expirations"] == 1
+
+    # A read that started before an invalidation does not cache what it read
+    cache = ReadCache(max_entries=2, ttl_seconds=60)
+    generation = cache.generation(("show", "list", "4"))
+    cache.invalidate(("show", "list", "5"))
+    cache.set(("show", "list", "4"), {"id": "4"}, generation)
+    generation = cache.generation(("list", "list"))
+    cache.set(("list", "list"), [], generation)
+    assert cache.get(("show", "list", "4")) is None and cache.get(("list", "list")) == []
+
+    # Namespaces are forgotten beyond max_namespaces, still without caching a stale read
+    cache = ReadCache(max_entries=2, ttl_seconds=60, max_namespaces=2)
+    generation = cache.generation(("show", "list", "6"))
+    for list_id in ["list", "a", "b", "c"]:
+        cache.invalidate(("show", list_id, "6"))
+    cache.set(("show", "list", "6"), {"id": "6"}, generation)
+    assert cache.get(("show", "list", "6")) is None and cache.snapshot()["namespaces"] == 2
+    cache.set(("show", "list", "6"), {"id": "6"}, cache.generation(("show", "list", "6")))
+    assert cache.get(("show", "list", "6")) == {"id": "6"}
+
+    disabled = ReadCache(enabled=False)
+    disabled.set(("show", "1"), {"id": "1"})
+    assert disabled.get(("show", "1")) is None
+
+def test_cached_reads_follow_writes():
+    show_id = create_show("Cached Show", "watching", 1)
+    other_id = create_show("Other Cached Show", "watching", 1)
+    hits = read_cache.hits
+    for attempt in range(2):
+        assert client.get(f"/shows/{show_id}").json()["current_episode"] == 1
+        assert len(client.get("/shows/").json()) == 2
+    assert read_cache.hits == hits + 2
+
+    client.put(f"/shows/{show_id}", json={"title": "Cached Show", "status": "completed", "current_episode": 12})
+    assert client.get(f"/shows/{show_id}").json()["current_episode"] == 12
+    assert [show["current_episode"] for show in client.get("/shows/").json()] == [12, 1]
+
+    create_show("New Cached Show", "watching", 1)
+    assert len(client.get("/shows/").json()) == 3
+
+    client.post("/shows/batch/delete", json={"ids": [other_id]})
+    assert client.get(f"/shows/{other_id}").status_code == 404
+    assert len(client.get("/shows/").json()) == 2
+
+    client.delete(f"/shows/{show_id}")
+    assert client.get(f"/shows/{show_id}").status_code == 404
+
+def test_identical_reads_share_one_storage_call(monkeypatch):
+    show_id = create_show("Popular Show", "watching", 1)
+    calls = []
+    get, list_shows = repository.get, repository.list_shows
+
+    async def slow_get(*args):
+        calls.append("get")
+        await asyncio.sleep(0.05)
+        return await get(*args)
+
+    async def slow_list_shows(*args, **kwargs):
+        calls.append("list")
+        await asyncio.sleep(0.05)
+        return await list_shows(*args, **kwargs)
+
+    monkeypatch.setattr(repository, "get", slow_get)
+    monkeypatch.setattr(repository, "list_shows", slow_list_shows)
+
+    async def scenario():
+        async with AsyncClient(app=app, base_url="http://test") as async_client:
+            responses = await asyncio.gather(*(async_client.get(path) for path in [f"/shows/{show_id}", "/shows/"] * 5))
+            assert all(response.status_code == 200 for response in responses)
+            assert sorted(calls) == ["get", "list"]
+
+            # A read starting after a write does not join a read started before it
+            read_cache.clear()
+            pending = asyncio.ensure_future(async_client.get(f"/shows/{show_id}"))
+            await asyncio.sleep(0.01)
+            await async_client.put(f"/shows/{show_id}", json={"title": "Popular Show", "status": "watching", "current_episode": 2})
+            response = await async_client.get(f"/shows/{show_id}")
+            assert response.json()["current_episode"] == 2
+            await pending
+
+    asyncio.run(scenario())
+    assert calls.count("get") == 3
+
+def test_reads_finishing_after_a_write_are_not_cached(monkeypatch):
+    show_id = create_show("Racing Show", "watching", 1)
+    get, list_shows = repository.get, repository.list_shows
+
+    async def slow_get(*args):
+        show = await get(*args)
+        await asyncio.sleep(0.05)
+        return show
+
+    async def slow_list_shows(*args, **kwargs):
+        shows = await list_shows(*args, **kwargs)
+        await asyncio.sleep(0.05)
+        return shows
+
+    async def scenario():
+        async with AsyncClient(app=app, base_url="http://test") as async_client:
+            # Both reads see the show before the write and end after it
+            monkeypatch.setattr(repository, "get", slow_get)
+            monkeypatch.setattr(repository, "list_shows", slow_list_shows)
+            pending = asyncio.gather(async_client.get(f"/shows/{show_id}"), async_client.get("/shows/"))
+            await asyncio.sleep(0.01)
+            await async_client.put(f"/shows/{show_id}", json={"title": "Racing Show", "status": "watching", "current_episode": 2})
+            await pending
+            monkeypatch.undo()
+
+            assert (await async_client.get(f"/shows/{show_id}")).json()["current_episode"] == 2
+            assert (await async_client.get("/shows/")).json()[0]["current_episode"] == 2
+            response = await async_client.post("/shows/batch/get", json={"ids": [show_id]})
+            assert response.json()["results"][0]["show"]["current_episode"] == 2
+
+    asyncio.run(scenario())
+
+def test_admission_rejects_requests_over_the_limit():
+    async def slow_app(scope, receive, send):
+        await asyncio.sleep(0.05)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"done"})
+
+    limit = AdmissionLimit(1, queue_timeout=0.01, max_queue=1)
+    middleware = AdmissionMiddleware(slow_app, {("GET", "/export/"): limit}, retry_after=3, registry=Registry())
+
+    async def scenario():
+        async with AsyncClient(app=middleware, base_url="http://test") as async_client:
+            # One request runs, one waits in line and times out, the third finds the line full
+            responses = await asyncio.gather(*(async_client.get("/export/") for _ in range(3)))
+            other = await async_client.get("/shows/")
+        return responses, other
+
+    responses, other = asyncio.run(scenario())
+    assert sorted(response.status_code for response in responses) == [200, 503, 503]
+    assert all(response.headers["retry-after"] == "3" for response in responses if response.status_code == 503)
+    assert other.status_code == 200
+    assert limit.admitted == 1 and limit.rejected == 2 and limit.running == 0
+
+def test_change_broker_resumes_and_resets_slow_clients():
+    async def scenario():
+        broker = ChangeBroker(buffer_size=3, queue_size=2)
+        first = broker.publish("create", {"id": "1"})
+        broker.publish("update", {"id": "1"})
+
+        # A client resuming after the first event gets what it missed
+        resumed = broker.subscribe(first.id)
+        assert (await resumed.get()).type == "update"
+
+        # Events no longer kept, or from another epoch, can only be answered with a reset
+        broker.publish("create", {"id": "2"})
+        broker.publish("create", {"id": "3"})
+        for event_id in (f"{broker.epoch}-0", "other-1"):
+            assert (await broker.subscribe(event_id).get()).type == "reset"
+
+        # A subscriber that falls behind gets a single reset instead of a growing backlog
+        slow = broker.subscribe()
+        for i in range(5):
+            broker.publish("create", {"id": str(i)})
+        assert slow.overflows == 2
+        assert slow.queue.qsize() == 1
+        assert (await slow.get()).type == "reset"
+
+        broker.external_feed = True
+        broker.publish_write("delete", {"id": "1"})
+        assert broker.sequence == 9
+
+    asyncio.run(scenario())
@@ -1,18 +1,46 @@
 // Add a show format code
 
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import axios from 'axios';
 import { useNavigate } from 'react-router-dom';
 import './styles.css';
 
 const API_URL = 'http://localhost:8000';
+// Pause in typing before suggestions are fetched.
+const SUGGEST_DELAY_MS = 200;
 
 const AddShowForm = () => {
   const [title, setTitle] = useState('');
   const [status, setStatus] = useState('Watching');
   const [currentEpisode, setCurrentEpisode] = useState(0);
+  const [suggestions, setSuggestions] = useState([]);
   const navigate = useNavigate();
 
+  // Existing titles starting with what has been typed, to spot duplicates early. They are
+  // fetched once typing pauses, and a request for an older title is aborted so its response
+  // cannot replace newer suggestions.
+  useEffect(() => {
+    if (!title) {
+      setSuggestions([]);
+      return undefined;
+    }
+    const controller = new AbortController();
+    const timer = setTimeout(async () => {
+      try {
+        const response = await axios.get(`${API_URL}/shows/suggest`, { params: { q: title }, signal: controller.signal });
+        setSuggestions(response.data);
+      } catch (error) {
+        if (!axios.isCancel(error)) {
+          setSuggestions([]);
+        }
+      }
+    }, SUGGEST_DELAY_MS);
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
+    };
+  }, [title]);
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     try {
@@ -41,8 +69,14 @@ const AddShowForm = () => {
             type="text"
             value={title}
             onChange={(e) => setTitle(e.target.value)}
+            list="title-suggestions"
             required
           />
+          <datalist id="title-suggestions">
+            {suggestions.map((suggestion) => (
+              <option key={suggestion} value={suggestion} />
+            ))}
+          </datalist>
         </div>
         <div>
           <label>Status:</label>
@@ -8,18 +8,48 @@ import './styles.css';
 const API_URL = 'http://localhost:8000';
 
 const ShowsList = () => {
-    const [shows, setShows] = useState([]);
     const [filteredShows, setFilteredShows] = useState([]);
+    const [category, setCategory] = useState('All');
     const navigate = useNavigate();
 
     useEffect(() => {
-        fetchShows();
-    }, []);
+        fetchShows(category);
+    }, [category]);
 
-    const fetchShows = async () => {
+    // Apply the server's change feed to the list instead of refetching it after every change.
+    useEffect(() => {
+        const matches = (show) => category === 'All' || show.status === category;
+        const source = new EventSource(`${API_URL}/shows/events`);
+
+        source.addEventListener('create', (event) => {
+            const show = JSON.parse(event.data);
+            if (matches(show)) {
+                setFilteredShows((shows) => [...shows.filter((s) => s.id !== show.id), show]);
+            }
+        });
+        source.addEventListener('update', (event) => {
+            const show = JSON.parse(event.data);
+            setFilteredShows((shows) => {
+                if (!matches(show)) {
+                    return shows.filter((s) => s.id !== show.id);
+                }
+                return shows.map((s) => (s.id === show.id ? show : s));
+            });
+        });
+        source.addEventListener('delete', (event) => {
+            const { id } = JSON.parse(event.data);
+            setFilteredShows((shows) => shows.filter((s) => s.id !== id));
+        });
+        source.addEventListener('reset', () => fetchShows(category));
+
+        return () => source.close();
+    }, [category]);
+
+    // Filtering by status is done by the server, so every page is already filtered.
+    const fetchShows = async (category) => {
         try {
-            const response = await axios.get(`${API_URL}/shows/`);
-            setShows(response.data);
+            const params = category === 'All' ? {} : { status: category };
+            const response = await axios.get(`${API_URL}/shows/`, { params });
             setFilteredShows(response.data);
         } catch (error) {
             console.error('Failed to fetch shows:', error);
@@ -29,7 +59,7 @@ const ShowsList = () => {
     const handleDelete = async (id) => {
         try {
             await axios.delete(`${API_URL}/shows/${id}`);
-            fetchShows();
+            setFilteredShows((shows) => shows.filter((s) => s.id !== id));
         } catch (error) {
             console.error('Failed to delete show:', error);
         }
@@ -40,12 +70,7 @@ const ShowsList = () => {
     };
 
     const handleSortByCategory = (category) => {
-        if (category === 'All') {
-            setFilteredShows(shows);
-        } else {
-            const filtered = shows.filter(show => show.status === category);
-            setFilteredShows(filtered);
-        }
+        setCategory(category);
     };
 
     const handleExport = async () => {